@@ -9,7 +9,22 @@ from app.routes.community import community_bp
 from app.routes.admin import admin_bp
 from app.routes.wellness import wellness_bp
 from app.routes.whatsapp import whatsapp_bp
-from app.services.ai_service import genai
+from app.services.webhook_queue import webhook_pool
+from app.services.outbound_dispatcher import outbound_dispatcher
+from app.services.outbox_service import outbox_relay
+from app.services import dedup_service, session_service, outbox_service, response_cache, counseling_service, slot_service
+
+def ensure_indexes():
+    """
+    Creates the MongoDB indexes the services rely on.
+    Failures are logged so the API can still boot without a reachable DB;
+    each service is tried on its own so one failure doesn't skip the rest.
+    """
+    for service in (dedup_service, session_service, outbox_service, response_cache, counseling_service, slot_service):
+        try:
+            service.ensure_indexes()
+        except Exception as e:
+            print(f"WARNING: Could not ensure MongoDB indexes for {service.__name__}: {e}")
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -32,6 +47,21 @@ def create_app(config_class=Config):
     app.register_blueprint(wellness_bp, url_prefix='/api/wellness')
     app.register_blueprint(whatsapp_bp, url_prefix='/api/whatsapp')
 
+    with app.app_context():
+        ensure_indexes()
+
+    # Background processing for WhatsApp webhooks
+    if config_class.WHATSAPP_ASYNC_WEBHOOK:
+        webhook_pool.start(app)
+    if config_class.WHATSAPP_ASYNC_SEND:
+        outbound_dispatcher.start(app)
+    if config_class.OUTBOX_RELAY_ENABLED:
+        outbox_relay.start(app)
+    if config_class.SESSION_CACHE_ENABLED:
+        session_service.session_cache.start(app)
+    if config_class.SESSION_ARCHIVER_ENABLED:
+        session_service.session_archiver.start(app)
+
     @app.route('/')
     def home():
         return "Mindly Flask API is running!"
@@ -13,6 +13,38 @@ class Config:
     MONGO_URI = os.getenv("MONGO_URI")
     JWT_SECRET = os.getenv("JWT_SECRET")
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")  # gemini | stub
+    LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+    LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "15"))
+    LLM_RISK_TIMEOUT_SECONDS = float(os.getenv("LLM_RISK_TIMEOUT_SECONDS", "5"))
+    LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+    # Offline stub backend (LLM_BACKEND=stub) for load tests and benchmarks
+    LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "800"))
+    LLM_STUB_JITTER_MS = float(os.getenv("LLM_STUB_JITTER_MS", "200"))
+    LLM_STUB_DISTRIBUTION = os.getenv("LLM_STUB_DISTRIBUTION", "normal")  # fixed | uniform | normal | lognormal
+    LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", "0"))
+    LLM_STUB_FAILURE_RATE = float(os.getenv("LLM_STUB_FAILURE_RATE", "0"))
+
+    # Emotional support: one structured call for risk + reply
+    MINDLY_COMBINED_AI = os.getenv("MINDLY_COMBINED_AI", "true").lower() == "true"
+    AI_PARALLEL_WORKERS = int(os.getenv("AI_PARALLEL_WORKERS", "8"))
+
+    # Emotional support conversation memory (approximate tokens)
+    MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+    MEMORY_RECENT_TOKENS = int(os.getenv("MEMORY_RECENT_TOKENS", "600"))
+    MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "250"))
+
+    # Cache for replies to repeated prompts (crisis messages always bypass it)
+    AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+    AI_CACHE_SHARED = os.getenv("AI_CACHE_SHARED", "false").lower() == "true"
+    AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", "3600"))
+    AI_CACHE_MAX_SIZE = int(os.getenv("AI_CACHE_MAX_SIZE", "1000"))
+
+    # Optional offline-trained model for the local risk pre-classifier
+    RISK_MODEL_PATH = os.getenv("RISK_MODEL_PATH")
+    RISK_MODEL_THRESHOLD = float(os.getenv("RISK_MODEL_THRESHOLD", "0.9"))
     DB_NAME = os.getenv("DB_NAME", "mindly_db")
     
     # WhatsApp Cloud API Configuration
@@ -20,6 +52,77 @@ class Config:
     WHATSAPP_VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
     WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
     WHATSAPP_FLOW_ID = os.getenv("WHATSAPP_FLOW_ID")
+    WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v18.0")
+
+    # Outbound Graph API connection pool
+    GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "3.05"))
+    GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "10"))
+    GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "20"))
+
+    # Asynchronous outbound sending (rate is messages/second per process)
+    WHATSAPP_ASYNC_SEND = os.getenv("WHATSAPP_ASYNC_SEND", "false").lower() == "true"
+    WHATSAPP_SEND_RATE = float(os.getenv("WHATSAPP_SEND_RATE", "80"))
+    WHATSAPP_SEND_BURST = int(os.getenv("WHATSAPP_SEND_BURST", "20"))
+    WHATSAPP_SEND_WORKERS = int(os.getenv("WHATSAPP_SEND_WORKERS", "4"))
+    WHATSAPP_SEND_QUEUE_SIZE = int(os.getenv("WHATSAPP_SEND_QUEUE_SIZE", "5000"))
+    WHATSAPP_SEND_MAX_RETRIES = int(os.getenv("WHATSAPP_SEND_MAX_RETRIES", "5"))
+    WHATSAPP_SEND_BACKOFF_BASE = float(os.getenv("WHATSAPP_SEND_BACKOFF_BASE", "1.0"))
+
+    # Webhook ingestion: acknowledge immediately and process on background workers
+    WHATSAPP_ASYNC_WEBHOOK = os.getenv("WHATSAPP_ASYNC_WEBHOOK", "false").lower() == "true"
+    WHATSAPP_WORKER_COUNT = int(os.getenv("WHATSAPP_WORKER_COUNT", "4"))
+    WHATSAPP_QUEUE_SIZE = int(os.getenv("WHATSAPP_QUEUE_SIZE", "1000"))
+    # Seconds the webhook waits for room in a full sender queue before answering 503
+    WHATSAPP_QUEUE_PUT_TIMEOUT = float(os.getenv("WHATSAPP_QUEUE_PUT_TIMEOUT", "2"))
+    WHATSAPP_WORKER_BATCH_SIZE = int(os.getenv("WHATSAPP_WORKER_BATCH_SIZE", "50"))
+
+    # Concurrent student notifications for bulk approvals
+    NOTIFY_POOL_SIZE = int(os.getenv("NOTIFY_POOL_SIZE", "8"))
+
+    # Notification outbox relay
+    OUTBOX_RELAY_ENABLED = os.getenv("OUTBOX_RELAY_ENABLED", "false").lower() == "true"
+    OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+    OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+    # Per-sender leases on chat_sessions while a webhook batch is processed
+    SESSION_LEASE_SECONDS = int(os.getenv("SESSION_LEASE_SECONDS", "60"))
+    SESSION_LEASE_WAIT_SECONDS = float(os.getenv("SESSION_LEASE_WAIT_SECONDS", "30"))
+
+    # Write-behind session cache; pair it with per-wa_id worker affinity.
+    # States in SESSION_SYNC_STATES (comma separated) are written immediately.
+    SESSION_CACHE_ENABLED = os.getenv("SESSION_CACHE_ENABLED", "false").lower() == "true"
+    SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "5000"))
+    SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "300"))
+    SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1"))
+    SESSION_SYNC_STATES = [s.strip() for s in os.getenv("SESSION_SYNC_STATES", "").split(",") if s.strip()]
+
+    # Idle chat sessions: archived after SESSION_ARCHIVE_AFTER_SECONDS,
+    # deleted by the TTL index after SESSION_IDLE_TTL_SECONDS if still present
+    SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", str(30 * 24 * 3600)))
+    SESSION_ARCHIVE_AFTER_SECONDS = int(os.getenv("SESSION_ARCHIVE_AFTER_SECONDS", str(14 * 24 * 3600)))
+    SESSION_ARCHIVE_BATCH_SIZE = int(os.getenv("SESSION_ARCHIVE_BATCH_SIZE", "500"))
+    SESSION_ARCHIVER_ENABLED = os.getenv("SESSION_ARCHIVER_ENABLED", "false").lower() == "true"
+    SESSION_ARCHIVE_INTERVAL = int(os.getenv("SESSION_ARCHIVE_INTERVAL", "3600"))
+
+    # Rows per page in the doctor's pending-request lists. WhatsApp lists hold
+    # at most 10 rows, shared with the bulk-action and paging rows.
+    DOCTOR_REQUESTS_PAGE_SIZE = int(os.getenv("DOCTOR_REQUESTS_PAGE_SIZE", "5"))
+
+    # Seconds a day's free-slot map is reused before reloading it from MongoDB
+    SLOT_CACHE_TTL_SECONDS = int(os.getenv("SLOT_CACHE_TTL_SECONDS", "60"))
+
+    # Users resolved from JWTs by token_required
+    PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "5000"))
+    PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+    # Per-state handler timings for the WhatsApp state machine (/api/admin/flow-stats)
+    FLOW_TIMING = os.getenv("FLOW_TIMING", "false").lower() == "true"
+
+    # Deduplication of Meta webhook redeliveries by message id
+    WHATSAPP_DEDUP_CACHE_SIZE = int(os.getenv("WHATSAPP_DEDUP_CACHE_SIZE", "10000"))
+    WHATSAPP_DEDUP_TTL_SECONDS = int(os.getenv("WHATSAPP_DEDUP_TTL_SECONDS", str(3 * 24 * 3600)))
     
     @staticmethod
     def check():
@@ -27,5 +130,6 @@ class Config:
         if Config.MONGO_URI and "localhost" in Config.MONGO_URI:
             print("WARNING: MONGO_URI contains 'localhost'. This will fail on Render!")
         print(f"DEBUG: GEMINI_API_KEY loaded: {'Set' if Config.GEMINI_API_KEY else 'MISSING'}")
+        print(f"DEBUG: LLM_BACKEND: {Config.LLM_BACKEND}")
         print(f"DEBUG: WHATSAPP_ACCESS_TOKEN loaded: {'Set' if Config.WHATSAPP_ACCESS_TOKEN else 'MISSING'}")
         print(f"DEBUG: WHATSAPP_FLOW_ID loaded: {Config.WHATSAPP_FLOW_ID if Config.WHATSAPP_FLOW_ID else 'MISSING'}")
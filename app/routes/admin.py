@@ -2,6 +2,8 @@ from flask import Blueprint, jsonify
 from app.database import get_db
 
 from app.routes.auth import token_required
+from app.services.llm_client import get_llm_client
+from app.services.conversation_flow import flow_stats
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -27,3 +29,18 @@ def get_stats(current_user):
         "stress_distribution": stress_dist,
         "pending_counseling": pending_sessions
     })
+
+@admin_bp.route('/llm-stats', methods=['GET'])
+@token_required
+def get_llm_stats(current_user):
+    client = get_llm_client()
+    return jsonify({
+        "circuit": client.breaker.state,
+        "calls": client.stats.snapshot()
+    })
+
+@admin_bp.route('/flow-stats', methods=['GET'])
+@token_required
+def get_flow_stats(current_user):
+    # Populated only when FLOW_TIMING is enabled
+    return jsonify({"states": flow_stats.snapshot()})
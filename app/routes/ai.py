@@ -1,6 +1,7 @@
-from flask import Blueprint, request, jsonify
-from app.services.ai_service import generate_response
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from app.services.ai_service import generate_response, stream_response
 from app.routes.assessments import token_required
+import json
 
 ai_bp = Blueprint('ai', __name__)
 
@@ -15,3 +16,26 @@ def chat(current_user_id):
         
     response = generate_response(user_message)
     return jsonify({'response': response})
+
+@ai_bp.route('/chat/stream', methods=['POST'])
+@token_required
+def chat_stream(current_user_id):
+    """
+    Streams the reply as server-sent events: one `data: {"delta": ...}`
+    event per chunk, then a final `event: done`.
+    """
+    data = request.get_json()
+    user_message = data.get('message')
+
+    if not user_message:
+        return jsonify({'message': 'Message is required'}), 400
+
+    def events():
+        for chunk in stream_response(user_message):
+            yield f"data: {json.dumps({'delta': chunk})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
@@ -7,6 +7,7 @@ import datetime
 
 from functools import wraps
 from app.extensions import mongo
+from app.services.principal_cache import get_principal
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -25,10 +26,8 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
         
         try:
-            from bson import ObjectId
             data = jwt.decode(token, Config.JWT_SECRET, algorithms=["HS256"])
-            db = get_db()
-            current_user = db.users.find_one({'_id': ObjectId(data['user_id'])})
+            current_user = get_principal(data['user_id'])
             if not current_user:
                  return jsonify({'message': 'User not found!'}), 401
         except Exception as e:
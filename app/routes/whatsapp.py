@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app.config import Config
-from app.services.whatsapp_service import handle_conversational_flow, send_whatsapp_message, send_whatsapp_button_message, send_whatsapp_list_message, send_whatsapp_flow_message
-from app.services.session_service import get_user_session, update_user_session
+from app.services.webhook_service import extract_messages, process_messages
+from app.services.webhook_queue import webhook_pool
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 
@@ -28,81 +28,28 @@ def verify_webhook():
 def handle_message():
     """
     Handles incoming messages (text, buttons, and lists) from WhatsApp.
+    With WHATSAPP_ASYNC_WEBHOOK enabled the messages are only validated and
+    queued, and the 200 is returned before any Mongo, Gemini or Graph work.
     """
     data = request.get_json()
     
     try:
         if data.get('object') == 'whatsapp_business_account':
-            for entry in data.get('entry', []):
-                for change in entry.get('changes', []):
-                    value = change.get('value', {})
-                    messages = value.get('messages', [])
-                    
-                    if messages:
-                        message = messages[0]
-                        sender_id = message.get('from')
-                        user_text = ""
-                        is_button = False
-                        
-                        # Handle Text Messages
-                        if message.get('type') == 'text':
-                            user_text = message.get('text', {}).get('body')
-                        
-                        # Handle Button Replies
-                        elif message.get('type') == 'interactive':
-                            interactive = message.get('interactive', {})
-                            if interactive.get('type') == 'button_reply':
-                                user_text = interactive.get('button_reply', {}).get('id')
-                                is_button = True
-                            # Handle List Replies
-                            elif interactive.get('type') == 'list_reply':
-                                user_text = interactive.get('list_reply', {}).get('id')
-                                is_button = True # Treat list selection as a button/id interaction
-                            # Handle WhatsApp Flow Replies
-                            elif interactive.get('type') == 'nfm_reply':
-                                import json
-                                nfm_reply = interactive.get('nfm_reply', {})
-                                response_data = json.loads(nfm_reply.get('response_json', '{}'))
-                                user_text = f"FLOW_SUBMIT_{nfm_reply.get('name', 'unknown')}"
-                                is_button = True
-                                # response_data will be added to session later
-                        
-                        # Handle Image Messages
-                        elif message.get('type') == 'image':
-                            image_id = message.get('image', {}).get('id')
-                            user_text = f"MEDIA_IMAGE_{image_id}"
-                            is_button = True # Treat media as a special automated interaction
-                        
-                        if user_text:
-                            # 1. Get current session (Only once)
-                            session_record = get_user_session(sender_id)
-                            
-                            # Handle Flow Data (if already captured in nfm_reply block)
-                            if 'response_data' in locals() and response_data:
-                                session_record['flow_response'] = response_data
-                            
-                            print(f"DEBUG: Processing {sender_id} | State: {session_record.get('state')} | Text: {user_text}", flush=True)
-
-                            # 2. Process conversation flow
-                            response_text, next_state, updated_data, buttons, list_data = handle_conversational_flow(
-                                sender_id, user_text, session_record, is_button=is_button
-                            )
-                            
-                            print(f"DEBUG: Next State: {next_state}", flush=True)
-
-                            # 3. Update session in DB
-                            update_user_session(sender_id, state=next_state, data=updated_data)
-                            
-                            # 4. Send response (List, Button, Flow or Text)
-                            if list_data:
-                                if isinstance(list_data, dict) and list_data.get("type") == "flow":
-                                    send_whatsapp_flow_message(sender_id, response_text, list_data)
-                                else:
-                                    send_whatsapp_list_message(sender_id, response_text, list_data)
-                            elif buttons:
-                                send_whatsapp_button_message(sender_id, response_text, buttons)
-                            else:
-                                send_whatsapp_message(sender_id, response_text)
+            messages = extract_messages(data)
+            if not (Config.WHATSAPP_ASYNC_WEBHOOK and webhook_pool.started):
+                # Never wait for a session leased elsewhere while Meta waits
+                # for the response; a 503 makes it redeliver, and messages
+                # processed here are dropped then as duplicates.
+                if process_messages(messages, lease_wait=0):
+                    return jsonify({"status": "busy"}), 503
+                return jsonify({"status": "success"}), 200
+
+            for inbound in messages:
+                if not webhook_pool.submit(inbound):
+                    # Never process inline: it would overtake this sender's
+                    # queued messages. Meta redelivers on 503, and messages
+                    # already queued are dropped then as duplicates.
+                    return jsonify({"status": "busy"}), 503
                             
             return jsonify({"status": "success"}), 200
         else:
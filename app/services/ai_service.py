@@ -1,7 +1,6 @@
-import google.generativeai as genai
-from app.config import Config
-
-genai.configure(api_key=Config.GEMINI_API_KEY)
+from app.services.llm_client import get_llm_client, LLMUnavailable
+from app.services.risk_classifier import fast_classify
+from app.services.response_cache import get_cached_response, set_cached_response, prompt_fingerprint
 
 # Safety settings
 safety_settings = [
@@ -11,10 +10,7 @@ safety_settings = [
     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
-model = genai.GenerativeModel(model_name="gemini-2.5-flash", safety_settings=safety_settings)
-
-def generate_response(user_message):
-    system_prompt = """
+SYSTEM_PROMPT = """
     You are Mindly, an AI mental health support assistant for a university student.
     Your goal is to provide empathetic, non-judgmental, and practical support.
     
@@ -27,9 +23,58 @@ def generate_response(user_message):
     
     User says: 
     """
+
+PROMPT_VERSION = prompt_fingerprint(SYSTEM_PROMPT)
+
+FALLBACK_RESPONSE = "I'm having trouble connecting right now, but I'm here for you."
+
+def _cache_risk_level(user_message):
+    """
+    Only messages the local classifier confidently resolves (and that are
+    not crises) are cacheable. Returns their risk level, else None.
+    """
+    level, confident = fast_classify(user_message)
+    return level if confident and level != "CRITICAL" else None
+
+def generate_response(user_message):
+    risk_level = _cache_risk_level(user_message)
+    if risk_level:
+        cached = get_cached_response(PROMPT_VERSION, user_message, risk_level)
+        if cached:
+            return cached
+
     try:
-        response = model.generate_content(system_prompt + user_message)
-        return response.text
-    except Exception as e:
+        response = get_llm_client().generate(SYSTEM_PROMPT + user_message, label="chat", safety_settings=safety_settings)
+    except LLMUnavailable as e:
         print(f"Gemini Error: {e}")
-        return "I'm having trouble connecting right now, but I'm here for you."
+        return FALLBACK_RESPONSE
+
+    if risk_level:
+        set_cached_response(PROMPT_VERSION, user_message, risk_level, response)
+    return response
+
+def stream_response(user_message):
+    """
+    Yields the reply in chunks as Gemini streams it.
+    Falls back to the canned message if nothing was produced.
+    """
+    risk_level = _cache_risk_level(user_message)
+    if risk_level:
+        cached = get_cached_response(PROMPT_VERSION, user_message, risk_level)
+        if cached:
+            yield cached
+            return
+
+    chunks = []
+    try:
+        for chunk in get_llm_client().generate_stream(SYSTEM_PROMPT + user_message, label="chat_stream", safety_settings=safety_settings):
+            chunks.append(chunk)
+            yield chunk
+    except LLMUnavailable as e:
+        print(f"Gemini Error: {e}")
+        if not chunks:
+            yield FALLBACK_RESPONSE
+        return
+
+    if risk_level:
+        set_cached_response(PROMPT_VERSION, user_message, risk_level, "".join(chunks))
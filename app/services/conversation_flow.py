@@ -0,0 +1,812 @@
+import re
+import time
+from functools import cached_property
+from datetime import datetime
+from bson import ObjectId
+from app.config import Config
+from app.database import get_db
+from app.services.whatsapp_service import classify_and_respond
+from app.services.conversation_memory import render_history, remember
+from app.services.counseling_service import (
+    approve_sessions, decline_session, handled_elsewhere, notify_students, delivery_summary,
+    find_sessions_with_students, find_pending_page, doctor_scope
+)
+from app.services.llm_client import LatencyStats
+from app.services.session_service import delete_user_session
+from app.services.principal_cache import invalidate_principal
+from app.services.slot_service import slot_index, bookable_dates, bookable_times, book_slot, release_slot
+
+# Table-driven state machine for Mindly WhatsApp conversations.
+# Each state owns a StateHandler: exact commands and case-insensitive
+# commands are dict lookups, ID-carrying commands (e.g. DR_APPROVE_<id>)
+# are matched by one precompiled prefix regex per state, and anything else
+# goes to the state's default handler. A handler returns the usual
+# (response, next_state, data, buttons, list_data) tuple, or None to fall
+# through to the catch-all.
+
+EMAIL_PATTERN = re.compile(r"[^@]+@[^@]+\.[^@]+")
+NUMBER_PATTERN = re.compile(r"\d+")
+
+GLOBAL_RESET_COMMANDS = {"RESET", "START", "HI", "HELLO", "TEST REGISTRATION"}
+
+STUDENT_MENU_BUTTONS = [
+    {"id": "STUDENT_SUPPORT", "title": "Support Chat"},
+    {"id": "STUDENT_BOOK", "title": "Book Session"},
+    {"id": "STUDENT_MY_SESSIONS", "title": "My Sessions"}
+]
+VIEW_MORE_BUTTON = [{"id": "DR_VIEW_REQS", "title": "View More"}]
+
+CATCH_ALL = ("Hello! Type 'START' to welcome Mindly.", "START", {}, None, None)
+
+flow_stats = LatencyStats()
+
+class FlowContext:
+    """
+    Everything a state handler needs for one inbound message.
+    The user document and the pending request page are loaded on first use
+    and memoized, so each message costs at most one query for each.
+    """
+
+    def __init__(self, wa_id, text, session, is_button=False):
+        self.wa_id = wa_id
+        self.text = text
+        self.session = session
+        self.is_button = is_button
+        self.state = session.get("state", "START")
+        self.data = session.get("data", {})
+        self.db = get_db()
+
+    @cached_property
+    def user(self):
+        return self.db.users.find_one({"wa_id": self.wa_id})
+
+    @cached_property
+    def pending_sessions(self):
+        return self.load_pending_page("from")
+
+    def load_pending_page(self, direction):
+        """
+        Loads the pending-request page after, before or starting at the page
+        stored in data["req_page"], and stores the new page in its place.
+        """
+        page = self.data.get("req_page") or {}
+        edge = page.get("end") if direction == "after" else page.get("start")
+        cursor = _decode_page_key(edge) if edge else None
+        sessions, has_more = find_pending_page(self.wa_id, cursor, direction)
+        if cursor and not sessions:
+            # Everything on that page was handled meanwhile; start over
+            cursor, direction = None, "after"
+            sessions, has_more = find_pending_page(self.wa_id)
+
+        if direction == "before":
+            has_prev, has_next = has_more, True
+        elif direction == "from":
+            has_prev, has_next = bool(cursor) and page.get("prev", False), has_more
+        else:
+            has_prev, has_next = bool(cursor), has_more
+
+        self.data["req_page"] = {
+            "start": _page_key(sessions[0]),
+            "end": _page_key(sessions[-1]),
+            "prev": has_prev,
+            "next": has_next,
+            "ids": [str(sess["_id"]) for sess in sessions]
+        } if sessions else {}
+        self.pending_sessions = sessions
+        return sessions
+
+def _page_key(sess):
+    created_at = sess.get("created_at")
+    return [created_at.isoformat() if created_at else None, str(sess["_id"])]
+
+def _decode_page_key(key):
+    created_at, session_id = key
+    return (datetime.fromisoformat(created_at) if created_at else None), ObjectId(session_id)
+
+class StateHandler:
+    """
+    Handlers for one conversation state.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.commands = {}
+        self.commands_ci = {}
+        self.prefixes = {}
+        self.prefix_pattern = None
+        self.default = None
+
+    def command(self, *names, ignore_case=False):
+        def register(fn):
+            for name in names:
+                if ignore_case:
+                    self.commands_ci[name.upper()] = fn
+                else:
+                    self.commands[name] = fn
+            return fn
+        return register
+
+    def prefix(self, *prefixes):
+        def register(fn):
+            for prefix in prefixes:
+                self.prefixes[prefix] = fn
+            # Longest prefix first so overlapping prefixes resolve correctly
+            alternation = "|".join(re.escape(p) for p in sorted(self.prefixes, key=len, reverse=True))
+            self.prefix_pattern = re.compile(f"^({alternation})(.*)$", re.DOTALL)
+            return fn
+        return register
+
+    def fallback(self, fn):
+        self.default = fn
+        return fn
+
+    def dispatch(self, ctx):
+        text = ctx.text
+        fn = self.commands.get(text) or self.commands_ci.get(text.upper())
+        if fn:
+            return fn(ctx, None)
+        if self.prefix_pattern:
+            match = self.prefix_pattern.match(text)
+            if match:
+                return self.prefixes[match.group(1)](ctx, match.group(2))
+        if self.default:
+            return self.default(ctx, None)
+        return None
+
+STATES = {}
+
+def state(name):
+    if name not in STATES:
+        STATES[name] = StateHandler(name)
+    return STATES[name]
+
+def handle_conversational_flow(wa_id, message_text, session, is_button=False):
+    """
+    Main state machine for Mindly WhatsApp conversations.
+    """
+    ctx = FlowContext(wa_id, message_text.strip(), session, is_button)
+    print(f"DEBUG: wa_id={wa_id}, state={ctx.state}, text={ctx.text}", flush=True)
+
+    # Global Reset Command
+    if ctx.text.upper() in GLOBAL_RESET_COMMANDS:
+        result = global_reset(ctx)
+        if result:
+            return result
+
+    # Global Role Selection (Independent of state to prevent loops)
+    if ctx.text in ROLE_FLOWS:
+        return role_flow(ctx)
+
+    handler = STATES.get(ctx.state)
+    if handler is None:
+        return CATCH_ALL
+
+    start = time.perf_counter()
+    result = handler.dispatch(ctx)
+    if Config.FLOW_TIMING:
+        flow_stats.record(ctx.state, (time.perf_counter() - start) * 1000, result is not None)
+    return result or CATCH_ALL
+
+# --- GLOBAL COMMANDS ---
+
+def forget_principal(ctx):
+    # The web API may hold this user from a JWT; call after changing them so
+    # a concurrent request cannot re-cache the old profile
+    if ctx.user:
+        invalidate_principal(ctx.user["_id"])
+
+def welcome_back(ctx, user):
+    role = user.get("role", "student").capitalize()
+    if role == "Doctor":
+        pending_count = ctx.db.counseling_sessions.count_documents(dict(doctor_scope(ctx.wa_id), status="Pending"))
+        response = (f"Welcome back, Dr. {user['name']}! 🩺\n\n"
+                    f"Your dashboard:\n"
+                    f"• Pending Sessions: {pending_count}\n"
+                    f"• Status: Active")
+
+        buttons = [{"id": "DR_VIEW_REQS", "title": "View Requests"}]
+        return response, "DOCTOR_DASHBOARD", {"role": "Doctor", "name": user["name"]}, buttons, None
+
+    response = f"Welcome back to Mindly, {user['name']}! 🎓\nHow can I support you today?"
+    return response, "STUDENT_MENU", {"role": "Student", "name": user["name"]}, STUDENT_MENU_BUTTONS, None
+
+def global_reset(ctx):
+    """
+    Welcomes back known users; new users continue from START.
+    """
+    # Special debug command to test the NEW registration flow
+    if ctx.text.upper() == "TEST REGISTRATION":
+        # ctx.user loads lazily; read it before the row is gone
+        user = ctx.user
+        ctx.db.users.delete_one({"wa_id": ctx.wa_id})
+        if user:
+            invalidate_principal(user["_id"])
+        delete_user_session(ctx.wa_id)
+        ctx.user = None
+        return "🗑️ *Test Mode:* Your old profile has been cleared.\nType 'HI' to start the new registration!", "START", {}, None, None
+
+    # 1. Check if user already exists in DB
+    if ctx.user:
+        return welcome_back(ctx, ctx.user)
+
+    # New User Flow
+    ctx.state = "START"
+    ctx.data = {}
+    return None
+
+ROLE_FLOWS = {
+    "ROLE_STUDENT": ("Welcome! Please complete the registration form:", "Student", "student", "Fill Form 🎓"),
+    "ROLE_DOCTOR": ("Mindly - Doctor Onboarding 🩺\n\nPlease complete the verification carefully:", "Doctor", "doctor", "Start Onboarding 🩺"),
+}
+
+def role_flow(ctx):
+    response, role, token_prefix, button = ROLE_FLOWS[ctx.text]
+    return response, "ROLE_SELECTION", {"role": role}, None, {
+        "type": "flow",
+        "flow_id": Config.WHATSAPP_FLOW_ID,
+        "flow_token": f"{token_prefix}_{ctx.wa_id}",
+        "button": button
+    }
+
+# --- START & REGISTRATION FLOW SUBMISSION ---
+
+@state("START").fallback
+def start(ctx, _):
+    # Silent redirect for existing users who are in START state
+    if ctx.user:
+        return welcome_back(ctx, ctx.user)
+
+    # Flow Submission Handler (Native Form Data)
+    if ctx.text.startswith("FLOW_SUBMIT_"):
+        return flow_submit(ctx)
+
+    response = "Welcome to Mindly 💙\nYour mental health companion. Please select your role to get started:"
+    buttons = [
+        {"id": "ROLE_STUDENT", "title": "I'm a Student"},
+        {"id": "ROLE_DOCTOR", "title": "I'm a Doctor"},
+        {"id": "ROLE_OTHER", "title": "Other"}
+    ]
+    return response, "ROLE_SELECTION", {}, buttons, None
+
+def flow_submit(ctx):
+    data = ctx.data
+    flow_data = ctx.session.get("flow_response", {})
+    if not flow_data:
+        return "❌ Error: Flow data lost. Please try the text registration below.", "START", {}, None, None
+
+    # Map Flow fields to Database fields
+    data.update({
+        "name": flow_data.get("full_name"),
+        "email": flow_data.get("email"),
+        "phone": flow_data.get("phone")
+    })
+
+    if "license_no" not in flow_data: # Student Flow
+        ctx.db.users.update_one({"wa_id": ctx.wa_id}, {"$set": {
+            "name": data["name"],
+            "email": data["email"],
+            "phone": data["phone"],
+            "role": "Student",
+            "registered_at": datetime.utcnow()
+        }}, upsert=True)
+        forget_principal(ctx)
+        return (f"🎊 *Registration Complete!*\n\n"
+                f"Welcome, {data['name']}! 🎓\n"
+                "How can I support you today?"), "STUDENT_MENU", data, STUDENT_MENU_BUTTONS, None
+
+    # Doctor Flow
+    data["license_no"] = flow_data["license_no"]
+    data["available_from_date"] = flow_data.get("from_date")
+    data["available_to_date"] = flow_data.get("to_date")
+
+    # Extract Times
+    start_time = flow_data.get("start_time", "09:00")
+    end_time = flow_data.get("end_time", "17:00")
+    data["available_times"] = [f"{start_time} - {end_time}"]
+
+    # Extract Media Tokens from multi-photo picker
+    id_proofs = flow_data.get("id_proofs", [])
+    if len(id_proofs) >= 2:
+        data["medical_id_img"] = id_proofs[0]
+        data["govt_id_img"] = id_proofs[1]
+    elif len(id_proofs) == 1:
+        data["medical_id_img"] = id_proofs[0]
+
+    # Finalize Dr Registration directly from Flow if IDs are provided
+    if data.get("medical_id_img") and data.get("govt_id_img"):
+        ctx.db.users.update_one({"wa_id": ctx.wa_id}, {"$set": {
+            "name": data["name"],
+            "email": data["email"],
+            "phone": data["phone"],
+            "license_no": data["license_no"],
+            "available_from_date": data.get("available_from_date"),
+            "available_to_date": data.get("available_to_date"),
+            "available_times": data["available_times"],
+            "medical_id": data["medical_id_img"],
+            "govt_id": data["govt_id_img"],
+            "role": "Doctor",
+            "status": "Active",
+            "registered_at": datetime.utcnow()
+        }}, upsert=True)
+        forget_principal(ctx)
+
+        return (f"🎊 *Registration Complete!*\n\n"
+                f"Welcome, Dr. {data['name']}! 🩺\n"
+                "Your professional credentials and availability have been stored.\n\n"
+                "Your dashboard:"), "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View Requests"}], None
+
+    return ("🎊 *Registration & Availability Received!*\n\n"
+            f"Welcome, Dr. {data['name']}! 🩺\n"
+            "To finish, please send a photo of your *Medical ID Card*:"), "DR_REG_MEDICAL_ID", data, None, None
+
+# --- DOCTOR DASHBOARD & 2-STEP MGMT ---
+
+def page_rows(ctx, prefix):
+    page = ctx.data.get("req_page", {})
+    rows = []
+    if page.get("prev"):
+        rows.append({"id": f"{prefix}_PREV", "title": "⬅️ Previous Page", "description": "Earlier requests"})
+    if page.get("next"):
+        rows.append({"id": f"{prefix}_NEXT", "title": "Next Page ➡️", "description": "More requests"})
+    return rows
+
+@state("DOCTOR_DASHBOARD").command("DR_VIEW_REQS", "VIEW REQUESTS", ignore_case=True)
+def view_requests(ctx, _):
+    # Always open the queue at its oldest requests
+    ctx.data.pop("req_page", None)
+    return request_list(ctx, None)
+
+@state("DOCTOR_LIST_REQS").command("DR_VIEW_REQS")
+def request_list(ctx, _):
+    pending_list = ctx.pending_sessions
+    if not pending_list:
+        return "*No pending requests at the moment.*", "DOCTOR_DASHBOARD", ctx.data, None, None
+
+    rows = []
+    for i, sess in enumerate(pending_list):
+        name = sess["student_name"]
+        display_name = (name[:20] + '..') if len(name) > 20 else name
+        rows.append({
+            "id": f"DR_SEL_REQ_{sess['_id']}",
+            "title": f"{i+1}. {display_name}",
+            "description": f"{sess['date']} @ {sess['time']}"
+        })
+
+    # Action Rows for Step 1
+    action_rows = [
+        {"id": "DR_BULK_APPROVE_ALL", "title": "Approve All ✅", "description": "Approve all current requests"},
+        {"id": "DR_BULK_DECLINE_ALL", "title": "Decline All ❌", "description": "Decline all current requests"},
+        {"id": "DR_MODE_MULTI_SELECT", "title": "Select Multiple 📋", "description": "Pick specific students to approve"}
+    ]
+
+    list_data = {
+        "button": "View/Manage",
+        "sections": [
+            {"title": "Student List", "rows": rows},
+            {"title": "Bulk Actions", "rows": action_rows}
+        ]
+    }
+    nav_rows = page_rows(ctx, "DR_REQS")
+    if nav_rows:
+        list_data["sections"].append({"title": "More Requests", "rows": nav_rows})
+    return "*Manage Requests*\nSelect a student to view details, or choose a bulk action below:", "DOCTOR_LIST_REQS", ctx.data, None, list_data
+
+@state("DOCTOR_LIST_REQS").command("DR_REQS_NEXT", "DR_REQS_PREV")
+def request_list_page(ctx, _):
+    ctx.load_pending_page("after" if ctx.text.endswith("NEXT") else "before")
+    return request_list(ctx, None)
+
+@state("DOCTOR_DASHBOARD").command("DR_DASHBOARD")
+def refresh_dashboard(ctx, _):
+    return "*Refreshing dashboard...*", "START", ctx.data, None, None
+
+@state("DOCTOR_LIST_REQS").prefix("DR_SEL_REQ_")
+def select_request(ctx, session_id):
+    found = find_sessions_with_students(dict(doctor_scope(ctx.wa_id), _id=ObjectId(session_id)), limit=1)
+    if not found:
+        return handled_elsewhere(session_id), "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+    sess = found[0]
+    if sess.get("status") != "Pending":
+        return handled_elsewhere(session_id), "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+    name = sess["student_name"]
+    response = (f"*Managing Request for:* {name}\n\n"
+                f"*Date:* {sess['date']}\n"
+                f"*Time:* {sess['time']}\n"
+                f"*Concern:* {sess['description']}\n\n"
+                "What would you like to do?")
+    buttons = [
+        {"id": f"DR_APPROVE_{session_id}", "title": "Approve"},
+        {"id": f"DR_DECLINE_{session_id}", "title": "Decline"},
+        {"id": "DR_VIEW_REQS", "title": "Back to List"}
+    ]
+    return response, "DOCTOR_MANAGE_REQ", ctx.data, buttons, None
+
+# Bulk All Actions
+@state("DOCTOR_LIST_REQS").command("DR_BULK_APPROVE_ALL")
+def bulk_approve_all(ctx, _):
+    approved, outbox_ids = approve_sessions(ctx.wa_id)
+    response = f"*Bulk Success:* {len(approved)} students approved!"
+    if approved:
+        response += "\n\n" + delivery_summary(notify_students(approved, outbox_ids))
+    return response, "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+
+@state("DOCTOR_LIST_REQS").command("DR_BULK_DECLINE_ALL")
+def bulk_decline_all(ctx, _):
+    res = ctx.db.counseling_sessions.update_many(
+        dict(doctor_scope(ctx.wa_id), status="Pending"),
+        {"$set": {"status": "Declined", "declined_by": ctx.wa_id, "slot_active": False}}
+    )
+    if res.modified_count:
+        slot_index.invalidate()
+    return f"*Bulk Success:* {res.modified_count} students declined.", "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+
+# --- STEP 2: MULTI-SELECT MODE (Checkbox Style) ---
+@state("DOCTOR_LIST_REQS").prefix("DR_TOGGLE_")
+def toggle_request(ctx, session_id):
+    selected_ids = ctx.data.get("selected_ids", [])
+    if session_id in selected_ids: selected_ids.remove(session_id)
+    else: selected_ids.append(session_id)
+    ctx.data["selected_ids"] = selected_ids
+    return multi_select(ctx, None)
+
+@state("DOCTOR_LIST_REQS").command("DR_MODE_MULTI_SELECT")
+def multi_select(ctx, _):
+    pending_list = ctx.pending_sessions
+    selected_ids = ctx.data.get("selected_ids", [])
+    rows = []
+    for i, sess in enumerate(pending_list):
+        name = sess["student_name"]
+        display_name = (name[:14] + '..') if len(name) > 16 else name
+        status_box = "☑️" if str(sess["_id"]) in selected_ids else "⬜"
+        rows.append({"id": f"DR_TOGGLE_{sess['_id']}", "title": f"{status_box} {i+1}. {display_name}", "description": f"{sess['date']} @ {sess['time']}"})
+
+    actions = []
+    if selected_ids:
+        actions.append({"id": "DR_BULK_SEL_APPROVE", "title": f"Approve Selected ({len(selected_ids)}) ✅", "description": "Approve all checked items"})
+    actions.append({"id": "DR_VIEW_REQS", "title": "Back to Main Menu ⬅️", "description": "Exit Multi-Select"})
+
+    list_data = {"button": "Select Students", "sections": [{"title": "Toggle selection", "rows": rows}, {"title": "Action", "rows": actions}]}
+    nav_rows = page_rows(ctx, "DR_MULTI")
+    if nav_rows:
+        list_data["sections"].append({"title": "More Requests", "rows": nav_rows})
+
+    prompt = ("*Select Multiple Mode*\n"
+              "Due to WhatsApp limits, you can pick one student at a time in the menu below. "
+              "It will re-open with your update.\n\n"
+              "🚀 *Turbo Tip:* Just *type* the numbers (e.g. `1,2,4`) to select many students at once!")
+
+    return prompt, "DOCTOR_LIST_REQS", ctx.data, None, list_data
+
+@state("DOCTOR_LIST_REQS").command("DR_MULTI_NEXT", "DR_MULTI_PREV")
+def multi_select_page(ctx, _):
+    ctx.load_pending_page("after" if ctx.text.endswith("NEXT") else "before")
+    return multi_select(ctx, None)
+
+# Handle Numeric Selection (Turbo Mode)
+@state("DOCTOR_LIST_REQS").fallback
+def turbo_select(ctx, _):
+    text = ctx.text
+    if not any(char.isdigit() for char in (text if len(text) < 10 else "")): # Basic check for numbers in short messages
+        return None
+
+    # Numbers refer to the page the doctor is looking at
+    page_ids = ctx.data.get("req_page", {}).get("ids") or [str(sess["_id"]) for sess in ctx.pending_sessions]
+    selected_ids = ctx.data.get("selected_ids", [])
+    for num_str in NUMBER_PATTERN.findall(text):
+        idx = int(num_str) - 1
+        if 0 <= idx < len(page_ids):
+            sid = page_ids[idx]
+            if sid in selected_ids: selected_ids.remove(sid)
+            else: selected_ids.append(sid)
+
+    ctx.data["selected_ids"] = selected_ids
+    # Show the updated menu
+    return multi_select(ctx, None)
+
+# Final Approval for Selective Multi
+@state("DOCTOR_LIST_REQS").command("DR_BULK_SEL_APPROVE")
+def bulk_approve_selected(ctx, _):
+    selected_ids = ctx.data.get("selected_ids", [])
+    approved, outbox_ids = approve_sessions(ctx.wa_id, selected_ids)
+    ctx.data["selected_ids"] = []
+    response = f"*Success:* {len(approved)} students approved & notified!"
+    taken = len(selected_ids) - len(approved)
+    if taken:
+        response += f"\n{taken} of your selection were already handled by another doctor."
+    if approved:
+        response += "\n\n" + delivery_summary(notify_students(approved, outbox_ids))
+    return response, "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+
+# Handle single approval/decline (kept stable)
+@state("DOCTOR_MANAGE_REQ").prefix("DR_APPROVE_")
+def approve_request(ctx, session_id):
+    approved, outbox_ids = approve_sessions(ctx.wa_id, [session_id])
+    if not approved:
+        return handled_elsewhere(session_id), "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+    notify_students(approved, outbox_ids)
+    return "*Session approved!*", "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+
+@state("DOCTOR_MANAGE_REQ").prefix("DR_DECLINE_")
+def decline_request(ctx, session_id):
+    if not decline_session(ctx.wa_id, session_id):
+        return handled_elsewhere(session_id), "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+    return "*Session declined.*", "DOCTOR_DASHBOARD", ctx.data, VIEW_MORE_BUTTON, None
+
+@state("DOCTOR_MANAGE_REQ").command("DR_VIEW_REQS")
+def back_to_requests(ctx, _):
+    return "*Returning to list...*", "DOCTOR_DASHBOARD", ctx.data, [{"id": "DR_VIEW_REQS", "title": "Click to Reload"}], None
+
+# --- STUDENT FLOW & SESSION MGMT ---
+
+@state("EMOTIONAL_SUPPORT").command("MENU", "EXIT", "BACK", ignore_case=True)
+def leave_support(ctx, _):
+    ctx.data.pop("memory", None)
+    return "*Back to Student Menu.* 🎓\nHow can I support you today?", "STUDENT_MENU", ctx.data, STUDENT_MENU_BUTTONS, None
+
+@state("EMOTIONAL_SUPPORT").fallback
+def support_message(ctx, _):
+    memory = ctx.data.get("memory")
+    risk_level, reply = classify_and_respond(ctx.text, render_history(memory))
+    print(f"DEBUG: Support message risk for {ctx.wa_id}: {risk_level}", flush=True)
+    ctx.data["memory"] = remember(memory, ctx.text, reply)
+    return reply, "EMOTIONAL_SUPPORT", ctx.data, None, None
+
+@state("STUDENT_MENU").command("STUDENT_SUPPORT")
+def start_support(ctx, _):
+    ctx.data.pop("memory", None)
+    return ("*Emotional Support Mode* 💙\n"
+            "Tell me what's on your mind. (Type 'MENU' anytime to exit)"), "EMOTIONAL_SUPPORT", ctx.data, None, None
+
+@state("STUDENT_MENU").command("STUDENT_BOOK")
+def start_booking(ctx, _):
+    return date_menu(ctx, "*Session Booking* 🗓️\nPlease select a date for your session:")
+
+def date_menu(ctx, prompt):
+    dates = bookable_dates()
+    if not dates:
+        return "*No counseling slots are open in the next 7 days.* Please check again later.", "STUDENT_MENU", ctx.data, STUDENT_MENU_BUTTONS, None
+
+    rows = []
+    for date_str in dates:
+        date = datetime.strptime(date_str, "%Y-%m-%d")
+        rows.append({
+            "id": f"BOOK_DATE_{date_str}",
+            "title": date.strftime("%A, %b %d"),
+            "description": "Select this day"
+        })
+
+    list_data = {
+        "button": "Choose Date",
+        "sections": [{"title": "Select a Day", "rows": rows}]
+    }
+    return prompt, "BOOKING_DATE", ctx.data, None, list_data
+
+def time_menu(ctx, prompt):
+    times = bookable_times(ctx.data["booking_date"])
+    if not times:
+        return date_menu(ctx, "❌ That day just filled up. Please pick another date:")
+
+    rows = []
+    for slot_time in times:
+        hour = int(slot_time[:2])
+        rows.append({
+            "id": f"TIME_{slot_time.replace(':', '')}",
+            "title": datetime.strptime(slot_time, "%H:%M").strftime("%I:%M %p"),
+            "description": "Morning" if hour < 12 else "Afternoon" if hour < 17 else "Evening"
+        })
+    list_data = {
+        "button": "Choose Time",
+        "sections": [{"title": "Available Slots", "rows": rows}]
+    }
+    return prompt, "BOOKING_TIME", ctx.data, None, list_data
+
+@state("STUDENT_MENU").command("STUDENT_MY_SESSIONS")
+def my_sessions(ctx, _):
+    my_sessions = list(ctx.db.counseling_sessions.find({
+        "student_wa_id": ctx.wa_id,
+        "status": {"$in": ["Pending", "Approved"]}
+    }).limit(10))
+
+    if not my_sessions:
+        return "*No active sessions found.*", "STUDENT_MENU", ctx.data, [{"id": "STUDENT_BOOK", "title": "Book One Now"}], None
+
+    rows = []
+    for sess in my_sessions:
+        rows.append({
+            "id": f"STUDENT_SEL_SESS_{sess['_id']}",
+            "title": f"{sess['date']} @ {sess['time']}",
+            "description": f"Status: {sess['status']}"
+        })
+
+    list_data = {
+        "button": "View Session",
+        "sections": [{"title": "Your Sessions", "rows": rows}]
+    }
+    return "*Your Sessions:*\nSelect one below to view details or cancel:", "STUDENT_MY_SESSIONS", ctx.data, None, list_data
+
+@state("STUDENT_MY_SESSIONS").prefix("STUDENT_SEL_SESS_")
+def select_my_session(ctx, session_id):
+    sess = ctx.db.counseling_sessions.find_one({"_id": ObjectId(session_id)})
+    if not sess:
+        return back_to_student_menu(ctx, None)
+    response = (f"*Session Details*\n\n"
+                f"• *Date:* {sess['date']}\n"
+                f"• *Time:* {sess['time']}\n"
+                f"• *Status:* {sess['status']}\n"
+                f"• *Concern:* {sess['description']}\n\n"
+                "What would you like to do?")
+    buttons = [
+        {"id": f"STUDENT_CANCEL_{session_id}", "title": "Cancel Session"},
+        {"id": "STUDENT_MY_SESSIONS", "title": "Back to List"}
+    ]
+    return response, "STUDENT_MANAGE_SESS", ctx.data, buttons, None
+
+@state("STUDENT_MY_SESSIONS").fallback
+def back_to_student_menu(ctx, _):
+    return "*Back to Student Menu.*", "START", ctx.data, None, None
+
+@state("STUDENT_MANAGE_SESS").prefix("STUDENT_CANCEL_")
+def cancel_session(ctx, session_id):
+    sess = ctx.db.counseling_sessions.find_one_and_update(
+        {"_id": ObjectId(session_id), "student_wa_id": ctx.wa_id, "status": {"$in": ["Pending", "Approved"]}},
+        {"$set": {"status": "Cancelled", "cancelled_by": "student", "slot_active": False}}
+    )
+    if not sess:
+        return "*This session can no longer be cancelled.*", "START", ctx.data, None, None
+    release_slot(sess)
+    return "*Session successfully cancelled.*", "START", ctx.data, None, None
+
+@state("STUDENT_MANAGE_SESS").command("STUDENT_MY_SESSIONS")
+def reload_my_sessions(ctx, _):
+    return "*Loading sessions...*", "STUDENT_MENU", {"button_click": "STUDENT_MY_SESSIONS"}, [{"id": "STUDENT_MY_SESSIONS", "title": "View Again"}], None
+
+@state("STUDENT_REG_NAME").fallback
+def student_reg_name(ctx, _):
+    ctx.data["name"] = ctx.text
+    return f"Welcome, {ctx.text}! 🎓\n\nWhat is your *Email Address*?", "STUDENT_REG_EMAIL", ctx.data, None, None
+
+@state("STUDENT_REG_EMAIL").fallback
+def student_reg_email(ctx, _):
+    if not EMAIL_PATTERN.match(ctx.text):
+        return "❌ Invalid email format. Please try again:", "STUDENT_REG_EMAIL", ctx.data, None, None
+    ctx.data["email"] = ctx.text
+    return "Got it. What is your *Phone Number*? (with country code):", "STUDENT_REG_PHONE", ctx.data, None, None
+
+@state("STUDENT_REG_PHONE").fallback
+def student_reg_phone(ctx, _):
+    data = ctx.data
+    data["phone"] = ctx.text
+    ctx.db.users.update_one({"wa_id": ctx.wa_id}, {"$set": {
+        "name": data["name"],
+        "email": data["email"],
+        "phone": data["phone"],
+        "role": "Student",
+        "registered_at": datetime.utcnow()
+    }}, upsert=True)
+    forget_principal(ctx)
+
+    return f"Nice to meet you, {data['name']}! 🎓\nHow can I support you today?", "STUDENT_MENU", data, STUDENT_MENU_BUTTONS, None
+
+# --- BOOKING ---
+
+@state("BOOKING_DATE").prefix("BOOK_DATE_")
+def booking_date(ctx, date_str):
+    if date_str not in bookable_dates():
+        return date_menu(ctx, "❌ Please select a date from the menu.")
+    ctx.data["booking_date"] = date_str
+    return time_menu(ctx, "Great! 🗓️ Now, pick a *time* that works for you:")
+
+@state("BOOKING_DATE").fallback
+def booking_date_invalid(ctx, _):
+    return "❌ Please select a date from the menu.", "BOOKING_DATE", ctx.data, None, None
+
+@state("BOOKING_TIME").prefix("TIME_")
+def booking_time(ctx, hhmm):
+    slot_time = hhmm[:2] + ":" + hhmm[2:]
+    if slot_time not in bookable_times(ctx.data["booking_date"]):
+        return time_menu(ctx, "❌ That time is no longer available. Please pick another:")
+    ctx.data["booking_time"] = slot_time
+    return "Understood. 🧠 Briefly describe your *concern* or what you'd like to talk about:", "BOOKING_DESC", ctx.data, None, None
+
+@state("BOOKING_TIME").fallback
+def booking_time_invalid(ctx, _):
+    return "❌ Please select a time slot from the menu.", "BOOKING_TIME", ctx.data, None, None
+
+@state("BOOKING_DESC").fallback
+def booking_desc(ctx, _):
+    data = ctx.data
+    new_session = {
+        "student_wa_id": ctx.wa_id,
+        "date": data["booking_date"],
+        "time": data["booking_time"],
+        "description": ctx.text,
+        "status": "Pending",
+        "created_at": datetime.utcnow()
+    }
+    if not book_slot(new_session):
+        return time_menu(ctx, "❌ Sorry, that slot was just booked by someone else. Please pick another time:")
+    # Notify Doctors (Optional but good)
+    return ("✅ *Booking Request Sent!* 🚀\n\nA doctor will review your request soon. You'll be notified once it's approved."), "STUDENT_MENU", data, [
+        {"id": "STUDENT_SUPPORT", "title": "Support Chat"},
+        {"id": "STUDENT_BOOK", "title": "Book Another"},
+        {"id": "STUDENT_MY_SESSIONS", "title": "My Sessions"}
+    ], None
+
+# --- DOCTOR TEXT REGISTRATION ---
+
+@state("DR_REG_NAME").fallback
+def dr_reg_name(ctx, _):
+    ctx.data["name"] = ctx.text
+    return f"Nice to meet you, Dr. {ctx.text}! 🩺\n\nWhat is your *Email Address*?", "DR_REG_EMAIL", ctx.data, None, None
+
+@state("DR_REG_EMAIL").fallback
+def dr_reg_email(ctx, _):
+    if not EMAIL_PATTERN.match(ctx.text):
+        return "❌ Invalid email format. Please try again (e.g. name@example.com):", "DR_REG_EMAIL", ctx.data, None, None
+    ctx.data["email"] = ctx.text
+    return "Got it. Now, what is your *Phone Number*? (with country code):", "DR_REG_PHONE", ctx.data, None, None
+
+@state("DR_REG_PHONE").fallback
+def dr_reg_phone(ctx, _):
+    ctx.data["phone"] = ctx.text
+    return "Thank you. Finally, what is your *Medical License Number*?", "DR_REG_LICENSE", ctx.data, None, None
+
+@state("DR_REG_LICENSE").fallback
+def dr_reg_license(ctx, _):
+    ctx.data["license_no"] = ctx.text
+    # Transition to Media Upload
+    return ("📄 *Identity Verification*\n\n"
+            "To verify your professional status, please send a photo of your *Medical ID Card* now:"), "DR_REG_MEDICAL_ID", ctx.data, None, None
+
+@state("DR_REG_MEDICAL_ID").prefix("MEDIA_IMAGE_")
+def dr_reg_medical_id(ctx, image_id):
+    ctx.data["medical_id_img"] = image_id
+    return "✅ Received! Finally, please send a photo of any *Government ID* (e.g. Aadhaar, License):", "DR_REG_GOVT_ID", ctx.data, None, None
+
+@state("DR_REG_MEDICAL_ID").fallback
+def dr_reg_medical_id_invalid(ctx, _):
+    return "❌ Please send an *image* of your Medical ID Card.", "DR_REG_MEDICAL_ID", ctx.data, None, None
+
+@state("DR_REG_GOVT_ID").prefix("MEDIA_IMAGE_")
+def dr_reg_govt_id(ctx, image_id):
+    data = ctx.data
+    data["govt_id_img"] = image_id
+
+    # Finalize Registration
+    ctx.db.users.update_one({"wa_id": ctx.wa_id}, {"$set": {
+        "name": data["name"],
+        "email": data["email"],
+        "phone": data["phone"],
+        "license_no": data["license_no"],
+        "available_dates": data.get("available_dates", []),
+        "available_times": data.get("available_times", []),
+        "medical_id": data["medical_id_img"],
+        "govt_id": data["govt_id_img"],
+        "role": "Doctor",
+        "status": "Active",
+        "registered_at": datetime.utcnow()
+    }}, upsert=True)
+    forget_principal(ctx)
+
+    return (f"🎊 *Registration Complete!*\n\n"
+            f"Welcome to the team, Dr. {data['name']}! 🩺\n"
+            f"Your professional credentials have been securely stored for verification.\n\n"
+            "Your dashboard is now ready."), "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View Requests"}], None
+
+@state("DR_REG_GOVT_ID").fallback
+def dr_reg_govt_id_invalid(ctx, _):
+    return "❌ Please send an *image* of your Government ID.", "DR_REG_GOVT_ID", ctx.data, None, None
+
+# --- OTHER ---
+
+@state("ROLE_SELECTION").command("ROLE_OTHER")
+def role_other(ctx, _):
+    return "Thank you! Please tell us how we can help you specifically.", "OTHER_FLOW", {"role": "Other"}, None, None
+
+@state("ROLE_SELECTION").fallback
+def role_selection_prompt(ctx, _):
+    return "Please select your role from the buttons above ⬆️", "ROLE_SELECTION", {}, None, None
+
+@state("OTHER_FLOW").fallback
+def other_flow(ctx, _):
+    return "Thank you for sharing. We will get back to you soon.", "START", {}, None, None
@@ -0,0 +1,91 @@
+from app.config import Config
+from app.services.llm_client import get_llm_client, LLMUnavailable
+
+# Per-wa_id support chat memory, kept compactly in the session document:
+#   {"s": "<rolling summary>", "t": [["u", "..."], ["a", "..."], ...]}
+# Recent turns stay verbatim; once the memory exceeds its token budget the
+# oldest turns are folded into the summary, so prompt size stays bounded.
+
+SPEAKERS = {"u": "Student", "a": "Mindly"}
+
+SUMMARY_PROMPT = """You maintain a private running summary of a supportive chat between a university student and Mindly, a mental health support assistant.
+Update the summary with the new turns below. Keep what matters for continuing the conversation: the student's concerns, feelings, circumstances, coping ideas already suggested, and any signs of risk.
+Write plain prose, at most {max_words} words. Do not add advice or commentary.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+def estimate_tokens(text):
+    # Rough 4-characters-per-token estimate; good enough for budgeting
+    return len(text) // 4 + 1
+
+def new_memory():
+    return {"s": "", "t": []}
+
+def _format_turns(turns):
+    return "\n".join(f"{SPEAKERS[speaker]}: {text}" for speaker, text in turns)
+
+def render_history(memory):
+    """
+    Formats the memory for inclusion in a prompt. Empty memory gives "".
+    """
+    if not memory or (not memory.get("s") and not memory.get("t")):
+        return ""
+    parts = []
+    if memory.get("s"):
+        parts.append(f"Summary of earlier conversation: {memory['s']}")
+    if memory.get("t"):
+        parts.append(_format_turns(memory["t"]))
+    return "\n".join(parts)
+
+def _summarize(summary, turns):
+    max_tokens = Config.MEMORY_SUMMARY_TOKENS
+    try:
+        updated = get_llm_client().generate(
+            SUMMARY_PROMPT.format(max_words=int(max_tokens * 0.75), summary=summary or "(none)", turns=_format_turns(turns)),
+            label="memory_summary",
+            timeout=Config.LLM_RISK_TIMEOUT_SECONDS
+        ).strip()
+    except LLMUnavailable as e:
+        print(f"Error summarizing conversation memory: {e}")
+        # Keep the student's own words so context is not lost entirely
+        updated = " ".join(filter(None, [summary] + [text for speaker, text in turns if speaker == "u"]))
+    # Hard cap so a verbose summary cannot grow the prompt
+    return updated[-max_tokens * 4:]
+
+def remember(memory, user_text, reply):
+    """
+    Appends a turn pair and compacts the memory if it is over budget.
+    Returns the updated memory.
+    """
+    memory = memory or new_memory()
+    memory.setdefault("s", "")
+    memory.setdefault("t", [])
+    memory["t"].extend([["u", user_text], ["a", reply]])
+
+    total = estimate_tokens(memory["s"]) + sum(estimate_tokens(text) for _, text in memory["t"])
+    if total <= Config.MEMORY_TOKEN_BUDGET:
+        return memory
+
+    # Keep the newest turns that fit the recent budget, always at least one pair
+    recent_tokens = 0
+    keep = len(memory["t"])
+    while keep > 2:
+        cost = estimate_tokens(memory["t"][keep - 1][1]) + estimate_tokens(memory["t"][keep - 2][1])
+        if recent_tokens + cost > Config.MEMORY_RECENT_TOKENS:
+            break
+        recent_tokens += cost
+        keep -= 2
+
+    older, recent = memory["t"][:keep], memory["t"][keep:]
+    if not recent:
+        older, recent = memory["t"][:-2], memory["t"][-2:]
+    if older:
+        memory["s"] = _summarize(memory["s"], older)
+    memory["t"] = recent
+    return memory
@@ -0,0 +1,202 @@
+import uuid
+from bson import ObjectId
+from app.config import Config
+from pymongo import ReturnDocument
+from app.database import get_db
+from app.services.whatsapp_service import build_text_payload
+from app.services.outbox_service import run_in_transaction, enqueue_notifications, drain, outbox_relay
+from app.services.slot_service import release_slot
+
+SUMMARY_MAX_LINES = 10
+
+def ensure_indexes():
+    """
+    Backs keyset pagination over the doctor's pending-request queue, and
+    the users lookup that joins student names onto sessions.
+    """
+    db = get_db()
+    db.counseling_sessions.create_index([("status", 1), ("created_at", 1), ("_id", 1)])
+    db.users.create_index("wa_id")
+
+def find_sessions_with_students(match, limit=None, sort=None):
+    """
+    Counseling sessions joined with the requesting student's name in one
+    aggregation, instead of a users lookup per session. Each result carries
+    `student_name` ("Unknown" when the student has no profile).
+    """
+    db = get_db()
+    pipeline = [{"$match": match}]
+    if sort:
+        pipeline.append({"$sort": sort})
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        # Equality lookup so each row is an index probe on users.wa_id
+        {"$lookup": {
+            "from": "users",
+            "localField": "student_wa_id",
+            "foreignField": "wa_id",
+            "as": "student"
+        }},
+        {"$addFields": {"student_name": {"$ifNull": [{"$arrayElemAt": ["$student.name", 0]}, "Unknown"]}}},
+        {"$project": {"student": 0}}
+    ]
+    return list(db.counseling_sessions.aggregate(pipeline))
+
+def doctor_scope(doctor_wa_id):
+    """
+    Sessions a doctor may see and act on: those booked into their own slot,
+    and requests made before slots existed, which have no doctor yet.
+    """
+    return {"$or": [{"doctor_wa_id": doctor_wa_id}, {"doctor_wa_id": {"$exists": False}}]}
+
+def find_pending_page(doctor_wa_id, cursor=None, direction="after", limit=None):
+    """
+    One page of the doctor's Pending sessions in (created_at, _id) order,
+    oldest first.
+    `cursor` is the (created_at, _id) key of a page edge: "after" returns the
+    page following it, "before" the page preceding it and "from" the page
+    starting at it; without a cursor the first page is returned.
+    Returns (sessions, has_more), has_more telling whether another page lies
+    further in that direction.
+    """
+    limit = limit or Config.DOCTOR_REQUESTS_PAGE_SIZE
+    conditions = [{"status": "Pending"}, doctor_scope(doctor_wa_id)]
+    backwards = direction == "before"
+    if cursor:
+        created_at, session_id = cursor
+        op = "$lt" if backwards else "$gt"
+        id_op = "$gte" if direction == "from" else op
+        conditions.append({"$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "_id": {id_op: session_id}}
+        ]})
+    match = {"$and": conditions}
+
+    order = -1 if backwards else 1
+    sessions = find_sessions_with_students(match, limit=limit + 1, sort={"created_at": order, "_id": order})
+    has_more = len(sessions) > limit
+    sessions = sessions[:limit]
+    if backwards:
+        sessions.reverse()
+    return sessions, has_more
+
+def approval_message(sess):
+    return f"*Approved:* Your session for {sess['date']} @ {sess['time']} is confirmed! 🩺"
+
+def approve_sessions(doctor_wa_id, session_ids=None):
+    """
+    Approves Pending sessions in one update_many guarded on status, so a
+    session already handled elsewhere is never approved twice.
+    The student notifications are written to the outbox in the same
+    transaction. With session_ids=None every Pending session in the
+    doctor's scope is approved; sessions held in another doctor's slot are
+    never touched. Returns (approved sessions, outbox ids).
+    """
+    db = get_db()
+    batch_id = uuid.uuid4().hex
+    query = dict(doctor_scope(doctor_wa_id), status="Pending")
+    if session_ids is not None:
+        query["_id"] = {"$in": [ObjectId(sid) for sid in session_ids]}
+
+    approval = {"$set": {
+        "status": "Approved",
+        "approved_by": doctor_wa_id,
+        "approval_batch": batch_id
+    }}
+    projection = {"student_wa_id": 1, "date": 1, "time": 1}
+
+    def transition(session):
+        if session_ids is not None and len(session_ids) == 1:
+            # Single claim: the guarded update returns the document itself
+            claimed = db.counseling_sessions.find_one_and_update(
+                query, approval, projection=projection,
+                return_document=ReturnDocument.AFTER, session=session
+            )
+            approved = [claimed] if claimed else []
+        else:
+            res = db.counseling_sessions.update_many(query, approval, session=session)
+            approved = list(db.counseling_sessions.find(
+                {"approval_batch": batch_id}, projection, session=session
+            )) if res.modified_count else []
+        if not approved:
+            return [], []
+        outbox_ids = enqueue_notifications([{
+            "recipient": sess["student_wa_id"],
+            "payload": build_text_payload(sess["student_wa_id"], approval_message(sess)),
+            "kind": "approval",
+            "ref": str(sess["_id"])
+        } for sess in approved], session=session)
+        return approved, outbox_ids
+
+    return run_in_transaction(transition)
+
+def decline_session(doctor_wa_id, session_id):
+    """
+    Declines one of the doctor's sessions if it is still Pending and frees
+    its slot. Returns the session as it was before, or None if someone else
+    handled it first or it belongs to another doctor.
+    """
+    db = get_db()
+    sess = db.counseling_sessions.find_one_and_update(
+        dict(doctor_scope(doctor_wa_id), _id=ObjectId(session_id), status="Pending"),
+        {"$set": {"status": "Declined", "declined_by": doctor_wa_id, "slot_active": False}}
+    )
+    release_slot(sess)
+    return sess
+
+def handled_elsewhere(session_id):
+    """
+    Tells a doctor who lost a claim what happened to the request.
+    """
+    db = get_db()
+    sess = db.counseling_sessions.find_one(
+        {"_id": ObjectId(session_id)}, {"status": 1, "approved_by": 1, "declined_by": 1, "doctor_wa_id": 1}
+    )
+    if not sess:
+        return "*This request no longer exists.*"
+    status = sess.get("status", "handled")
+    if status == "Pending":
+        return "*This request is booked with another doctor.* No action needed."
+    by = sess.get("approved_by") if status == "Approved" else sess.get("declined_by")
+    doctor = db.users.find_one({"wa_id": by}, {"name": 1}) if by else None
+    if doctor:
+        return f"*Already {status.lower()} by Dr. {doctor.get('name', 'Unknown')}.* No action needed."
+    if status == "Cancelled":
+        return "*The student cancelled this request.*"
+    return f"*This request was already {status.lower()}.* No action needed."
+
+def notify_students(sessions, outbox_ids):
+    """
+    Delivers the approval notifications. When the outbox relay is running
+    they are left to it and None is returned; otherwise they are drained
+    right away, once, and [(session, delivered)] is returned. Without the
+    relay nothing retries a failed send, so failures are final here.
+    """
+    if not sessions or outbox_relay.started:
+        return None
+    results = drain(limit=len(outbox_ids), ids=outbox_ids)
+    return [(sess, results.get(str(sess["_id"]), False)) for sess in sessions]
+
+def delivery_summary(results):
+    """
+    Formats per-student delivery results for the doctor.
+    """
+    if results is None:
+        return "Students will be notified shortly. 📨"
+
+    db = get_db()
+    wa_ids = [sess["student_wa_id"] for sess, _ in results]
+    names = {u["wa_id"]: u.get("name", "Unknown") for u in db.users.find({"wa_id": {"$in": wa_ids}}, {"wa_id": 1, "name": 1})}
+
+    # Failures first; WhatsApp caps interactive message bodies at 1024 chars
+    ordered = sorted(results, key=lambda result: result[1])
+    lines = []
+    for sess, delivered in ordered[:SUMMARY_MAX_LINES]:
+        # Only the relay retries, and with it running results is None
+        mark = "✅" if delivered else "⚠️ not delivered"
+        lines.append(f"• {names.get(sess['student_wa_id'], 'Unknown')} ({sess['date']} @ {sess['time']}) {mark}")
+    if len(ordered) > SUMMARY_MAX_LINES:
+        delivered_count = sum(1 for _, delivered in ordered if delivered)
+        lines.append(f"...and {len(ordered) - SUMMARY_MAX_LINES} more ({delivered_count}/{len(ordered)} delivered)")
+    return "\n".join(lines)
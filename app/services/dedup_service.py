@@ -0,0 +1,105 @@
+import datetime
+import threading
+from collections import OrderedDict
+from pymongo.errors import BulkWriteError
+from app.config import Config
+from app.database import get_db
+
+DUPLICATE_KEY_ERROR = 11000
+
+class RecentMessageIds:
+    """
+    Bounded, thread-safe LRU of WhatsApp message ids already seen by this
+    process. Retries that hit the same worker are dropped without a DB call.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, message_id):
+        with self._lock:
+            if message_id in self._ids:
+                self._ids.move_to_end(message_id)
+                return True
+            return False
+
+    def discard(self, message_id):
+        with self._lock:
+            self._ids.pop(message_id, None)
+
+    def add(self, message_id):
+        with self._lock:
+            self._ids[message_id] = True
+            self._ids.move_to_end(message_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+recent_ids = RecentMessageIds(Config.WHATSAPP_DEDUP_CACHE_SIZE)
+
+def ensure_indexes():
+    """
+    Expires processed message ids after the dedup window.
+    """
+    db = get_db()
+    db.processed_messages.create_index("created_at", expireAfterSeconds=Config.WHATSAPP_DEDUP_TTL_SECONDS)
+
+def filter_new_messages(batch):
+    """
+    Drops messages whose WhatsApp id was already processed.
+    Checks the in-process LRU first, then claims the remaining ids in the
+    processed_messages collection with one unordered insert; ids rejected
+    with a duplicate key error were claimed by an earlier delivery.
+    """
+    fresh = []
+    claimed = set()
+    for inbound in batch:
+        message_id = inbound.get("id")
+        if not message_id:
+            fresh.append(inbound)
+            continue
+        if message_id in claimed or recent_ids.seen(message_id):
+            print(f"DEBUG: Skipping duplicate delivery {message_id}", flush=True)
+            continue
+        claimed.add(message_id)
+        fresh.append(inbound)
+
+    if not claimed:
+        return fresh
+
+    db = get_db()
+    now = datetime.datetime.utcnow()
+    ordered_ids = list(claimed)
+    duplicates = set()
+    try:
+        db.processed_messages.insert_many(
+            [{"_id": message_id, "created_at": now} for message_id in ordered_ids],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") == DUPLICATE_KEY_ERROR:
+                duplicates.add(ordered_ids[error["index"]])
+            else:
+                raise
+
+    for message_id in ordered_ids:
+        recent_ids.add(message_id)
+    for message_id in duplicates:
+        print(f"DEBUG: Skipping duplicate delivery {message_id}", flush=True)
+
+    return [inbound for inbound in fresh if inbound.get("id") not in duplicates]
+
+def release_message_ids(message_ids):
+    """
+    Gives up claims made by filter_new_messages when processing failed, so
+    Meta's redelivery of those messages is processed instead of dropped.
+    """
+    message_ids = [message_id for message_id in message_ids if message_id]
+    if not message_ids:
+        return
+    for message_id in message_ids:
+        recent_ids.discard(message_id)
+    db = get_db()
+    db.processed_messages.delete_many({"_id": {"$in": message_ids}})
@@ -0,0 +1,53 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from app.config import Config
+
+class GraphAPIClient:
+    """
+    Outbound client for the WhatsApp Cloud API messages endpoint.
+    Owns a pooled keep-alive Session with prebuilt auth headers, so replies
+    reuse warm TLS connections to graph.facebook.com.
+    """
+
+    def __init__(self, phone_number_id, access_token, api_version="v18.0",
+                 connect_timeout=3.05, read_timeout=10, pool_size=10):
+        self.url = f"https://graph.facebook.com/{api_version}/{phone_number_id}/messages"
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def send_message(self, payload):
+        """
+        Posts a message payload. Raises requests exceptions on failure.
+        """
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_graph_client():
+    """
+    Returns the process-wide Graph API client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphAPIClient(
+                    Config.WHATSAPP_PHONE_NUMBER_ID,
+                    Config.WHATSAPP_ACCESS_TOKEN,
+                    api_version=Config.WHATSAPP_API_VERSION,
+                    connect_timeout=Config.GRAPH_CONNECT_TIMEOUT,
+                    read_timeout=Config.GRAPH_READ_TIMEOUT,
+                    pool_size=Config.GRAPH_POOL_SIZE
+                )
+    return _client
@@ -0,0 +1,132 @@
+import json
+import random
+import re
+import threading
+import time
+from app.services.risk_classifier import fast_classify
+
+# Backends do the raw model calls for LLMClient, which adds deadlines,
+# circuit breaking and latency accounting on top. Select one with
+# Config.LLM_BACKEND.
+
+class GeminiBackend:
+    """
+    Google Gemini via google-generativeai. Model instances are cached.
+    """
+
+    def __init__(self, api_key):
+        # Imported here only so the offline stub runs without the SDK
+        import google.generativeai as genai
+        self.genai = genai
+        genai.configure(api_key=api_key)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name, safety_settings=None):
+        key = (model_name, repr(safety_settings))
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self.genai.GenerativeModel(model_name=model_name, safety_settings=safety_settings)
+                    self._models[key] = model
+        return model
+
+    def generate(self, prompt, model_name, safety_settings=None, timeout=None, generation_config=None):
+        response = self.model(model_name, safety_settings).generate_content(
+            prompt,
+            generation_config=generation_config,
+            request_options={"timeout": timeout}
+        )
+        return response.text
+
+    def generate_stream(self, prompt, model_name, safety_settings=None, timeout=None):
+        response = self.model(model_name, safety_settings).generate_content(
+            prompt,
+            stream=True,
+            request_options={"timeout": timeout}
+        )
+        for chunk in response:
+            yield chunk.text
+
+class StubBackend:
+    """
+    Deterministic offline backend for load tests and benchmarks.
+    Sleeps for a latency drawn from a seeded distribution and returns canned
+    outputs shaped like the real ones (a risk label, JSON for structured
+    calls, or a supportive reply), so no network or API spend is involved.
+    """
+
+    REPLY = ("That sounds like a lot to carry right now, and it makes sense to feel this way. "
+             "Let's take it one small step at a time. Would you like to try a short breathing exercise, "
+             "or talk through what's weighing on you most?")
+    SUMMARY = "The student has been sharing academic stress and how they are coping."
+
+    def __init__(self, latency_ms=800, jitter_ms=200, distribution="normal", seed=0, failure_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        with self._lock:
+            if self.distribution == "fixed":
+                latency = self.latency_ms
+            elif self.distribution == "uniform":
+                latency = self._rng.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+            elif self.distribution == "lognormal":
+                # Heavy right tail like real LLM latencies; median is latency_ms
+                sigma = self.jitter_ms / self.latency_ms if self.latency_ms else 0
+                latency = self.latency_ms * self._rng.lognormvariate(0, sigma)
+            else:
+                latency = self._rng.gauss(self.latency_ms, self.jitter_ms)
+            failed = self._rng.random() < self.failure_rate
+        return max(0.0, latency) / 1000, failed
+
+    def _wait(self, timeout):
+        latency, failed = self._sample()
+        if timeout and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"stub call exceeded {timeout}s deadline")
+        time.sleep(latency)
+        if failed:
+            raise RuntimeError("stub backend injected failure")
+        return latency
+
+    def _canned(self, prompt, generation_config=None):
+        user_message = prompt.rsplit("User message:", 1)[-1].strip()
+        level, _ = fast_classify(user_message)
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            return json.dumps({"risk_level": level, "reply": self.REPLY})
+        if "emotional risk classification system" in prompt:
+            return level
+        if "running summary" in prompt:
+            return self.SUMMARY
+        return self.REPLY
+
+    def generate(self, prompt, model_name, safety_settings=None, timeout=None, generation_config=None):
+        self._wait(timeout)
+        return self._canned(prompt, generation_config)
+
+    def generate_stream(self, prompt, model_name, safety_settings=None, timeout=None):
+        # First chunk arrives after the sampled latency, the rest shortly after
+        latency = self._wait(timeout)
+        chunks = re.findall(r"\S+\s*", self._canned(prompt))
+        for i in range(0, len(chunks), 8):
+            if i:
+                time.sleep(latency * 0.05)
+            yield "".join(chunks[i:i + 8])
+
+def create_backend(config):
+    if config.LLM_BACKEND == "stub":
+        return StubBackend(
+            latency_ms=config.LLM_STUB_LATENCY_MS,
+            jitter_ms=config.LLM_STUB_JITTER_MS,
+            distribution=config.LLM_STUB_DISTRIBUTION,
+            seed=config.LLM_STUB_SEED,
+            failure_rate=config.LLM_STUB_FAILURE_RATE
+        )
+    return GeminiBackend(config.GEMINI_API_KEY)
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+from app.config import Config
+from app.services.llm_backends import create_backend
+
+class LLMUnavailable(Exception):
+    """
+    Raised when a call is rejected by the circuit breaker or fails.
+    Callers fall back to their canned response.
+    """
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds, then lets a single trial call through.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Ends a trial call that finished without a verdict (e.g. a stream the
+        client abandoned), so the next call can try again.
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+class LatencyStats:
+    """
+    Per-label call counts, errors and recent latencies (milliseconds).
+    """
+
+    def __init__(self, window=500):
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, label, elapsed_ms, ok):
+        with self._lock:
+            entry = self._calls.setdefault(label, {"count": 0, "errors": 0, "recent": deque(maxlen=self.window)})
+            entry["count"] += 1
+            if not ok:
+                entry["errors"] += 1
+            entry["recent"].append(elapsed_ms)
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stats = {}
+            for label, entry in self._calls.items():
+                recent = sorted(entry["recent"])
+                stats[label] = {
+                    "count": entry["count"],
+                    "errors": entry["errors"],
+                    "p50_ms": round(recent[len(recent) // 2], 1) if recent else None,
+                    "p95_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1) if recent else None
+                }
+            return stats
+
+class LLMClient:
+    """
+    Shared model access for ai_service and whatsapp_service.
+    The backend (Gemini or the offline stub) does the raw calls; every call
+    carries a deadline, and a circuit breaker fails fast while the backend
+    is unhealthy.
+    """
+
+    def __init__(self, backend, default_model, timeout, breaker):
+        self.backend = backend
+        self.default_model = default_model
+        self.timeout = timeout
+        self.breaker = breaker
+        self.stats = LatencyStats()
+
+    def generate(self, prompt, label="generate", model_name=None, safety_settings=None, timeout=None, generation_config=None):
+        """
+        Returns the response text, or raises LLMUnavailable.
+        """
+        if not self.breaker.allow():
+            self.stats.record(label, 0.0, False)
+            raise LLMUnavailable(f"circuit open, skipping {label}")
+
+        start = time.perf_counter()
+        try:
+            text = self.backend.generate(
+                prompt,
+                model_name or self.default_model,
+                safety_settings=safety_settings,
+                timeout=timeout or self.timeout,
+                generation_config=generation_config
+            )
+        except Exception as e:
+            self.breaker.record_failure()
+            self.stats.record(label, (time.perf_counter() - start) * 1000, False)
+            raise LLMUnavailable(f"{label} failed: {e}") from e
+
+        self.breaker.record_success()
+        self.stats.record(label, (time.perf_counter() - start) * 1000, True)
+        return text
+
+    def generate_stream(self, prompt, label="generate_stream", model_name=None, safety_settings=None, timeout=None):
+        """
+        Yields response text chunks as Gemini produces them, or raises
+        LLMUnavailable. Time to first chunk is recorded as `<label>_ttft`.
+        """
+        if not self.breaker.allow():
+            self.stats.record(label, 0.0, False)
+            raise LLMUnavailable(f"circuit open, skipping {label}")
+
+        start = time.perf_counter()
+        first_chunk = True
+        settled = False
+        chunks = None
+        try:
+            chunks = self.backend.generate_stream(
+                prompt,
+                model_name or self.default_model,
+                safety_settings=safety_settings,
+                timeout=timeout or self.timeout
+            )
+            for text in chunks:
+                if not text:
+                    continue
+                if first_chunk:
+                    first_chunk = False
+                    self.stats.record(f"{label}_ttft", (time.perf_counter() - start) * 1000, True)
+                yield text
+        except GeneratorExit:
+            # The consumer stopped reading (e.g. the SSE client disconnected).
+            # Chunks already arriving show the backend is healthy; otherwise
+            # there is no verdict, but the breaker must not stay half-open.
+            settled = True
+            if first_chunk:
+                self.breaker.release_trial()
+            else:
+                self.breaker.record_success()
+            self.stats.record(f"{label}_abandoned", (time.perf_counter() - start) * 1000, True)
+            raise
+        except Exception as e:
+            settled = True
+            self.breaker.record_failure()
+            self.stats.record(label, (time.perf_counter() - start) * 1000, False)
+            raise LLMUnavailable(f"{label} failed: {e}") from e
+        finally:
+            if not settled:
+                settled = True
+                self.breaker.record_success()
+                self.stats.record(label, (time.perf_counter() - start) * 1000, True)
+            if chunks is not None and hasattr(chunks, "close"):
+                chunks.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """
+    Returns the process-wide LLM client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient(
+                    create_backend(Config),
+                    Config.LLM_MODEL,
+                    Config.LLM_TIMEOUT_SECONDS,
+                    CircuitBreaker(Config.LLM_BREAKER_FAILURES, Config.LLM_BREAKER_RESET_SECONDS)
+                )
+    return _client
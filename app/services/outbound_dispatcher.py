@@ -0,0 +1,192 @@
+import datetime
+import queue
+import random
+import threading
+import time
+import zlib
+import requests
+from app.config import Config
+from app.database import get_db
+from app.services.graph_client import get_graph_client
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` tokens are added per second up to
+    `capacity`; acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class OutboundDispatcher:
+    """
+    Sends Graph API payloads from background workers.
+
+    Sends are paced by a token bucket sized to our WhatsApp throughput tier
+    (per process), 429/5xx and network errors are retried with exponential
+    backoff, and messages that still fail land in outbound_dead_letters
+    where replay_dead_letters() can pick them up again.
+
+    Like the webhook workers, each sender owns a queue and payloads are
+    routed by a hash of the recipient, and a retry is waited out by the
+    worker itself, so replies to one user always go out in order.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.queues = []
+        self.bucket = None
+        self.threads = []
+        self.started = False
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        with self._lock:
+            if self.started:
+                return
+            self.app = app
+            self.bucket = TokenBucket(Config.WHATSAPP_SEND_RATE, Config.WHATSAPP_SEND_BURST)
+            for i in range(Config.WHATSAPP_SEND_WORKERS):
+                q = queue.Queue(maxsize=Config.WHATSAPP_SEND_QUEUE_SIZE)
+                t = threading.Thread(target=self._run, args=(q,), name=f"outbound-sender-{i}", daemon=True)
+                self.queues.append(q)
+                self.threads.append(t)
+                t.start()
+            self.started = True
+            print(f"DEBUG: Outbound dispatcher started with {Config.WHATSAPP_SEND_WORKERS} workers", flush=True)
+
+    def enqueue(self, payload, kind="message"):
+        """
+        Queues a payload for sending. Returns False if the dispatcher is not
+        running or is saturated, so the caller can send inline instead.
+        """
+        if not self.started:
+            return False
+        try:
+            self._shard(payload.get("to")).put_nowait({"payload": payload, "kind": kind, "attempts": 0})
+            return True
+        except queue.Full:
+            print(f"WARNING: Outbound queue full, sending {kind} inline", flush=True)
+            return False
+
+    def _shard(self, recipient):
+        return self.queues[zlib.crc32(str(recipient).encode("utf-8")) % len(self.queues)]
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            try:
+                while True:
+                    self.bucket.acquire()
+                    delay = self._deliver(item)
+                    if delay is None:
+                        break
+                    # Hold the queue: later replies to this user must wait
+                    time.sleep(delay)
+            except Exception as e:
+                print(f"Error in outbound dispatcher: {e}", flush=True)
+            finally:
+                q.task_done()
+
+    def _deliver(self, item):
+        """
+        Sends one payload. Returns the delay before retrying it, or None
+        once it was delivered or dead-lettered.
+        """
+        item["attempts"] += 1
+        try:
+            get_graph_client().send_message(item["payload"])
+            return None
+        except requests.HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            error = e.response.text if e.response is not None else str(e)
+            retryable = status_code in RETRYABLE_STATUS
+            retry_after = _retry_after_seconds(e.response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            status_code, error, retryable, retry_after = None, str(e), True, None
+        except Exception as e:
+            status_code, error, retryable, retry_after = None, str(e), False, None
+
+        if retryable and item["attempts"] <= Config.WHATSAPP_SEND_MAX_RETRIES:
+            delay = retry_after or backoff_delay(item["attempts"])
+            print(f"DEBUG: Retrying WhatsApp {item['kind']} in {delay:.1f}s (attempt {item['attempts']})", flush=True)
+            return delay
+
+        print(f"Error sending WhatsApp {item['kind']}: {status_code} {error}", flush=True)
+        with self.app.app_context():
+            dead_letter(item["payload"], item["kind"], error, status_code, item["attempts"])
+        return None
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter, capped at one minute.
+    """
+    return random.uniform(0, min(60.0, Config.WHATSAPP_SEND_BACKOFF_BASE * (2 ** (attempt - 1))))
+
+def _retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def dead_letter(payload, kind, error, status_code, attempts):
+    """
+    Stores a message that could not be delivered.
+    """
+    db = get_db()
+    db.outbound_dead_letters.insert_one({
+        "payload": payload,
+        "kind": kind,
+        "error": error,
+        "status_code": status_code,
+        "attempts": attempts,
+        "created_at": datetime.datetime.utcnow()
+    })
+
+def replay_dead_letters(limit=100):
+    """
+    Re-sends dead-lettered messages, oldest first.
+    Delivered messages are removed; failures stay with their attempt count
+    bumped. Returns (replayed, failed).
+    """
+    db = get_db()
+    client = get_graph_client()
+    bucket = TokenBucket(Config.WHATSAPP_SEND_RATE, Config.WHATSAPP_SEND_BURST)
+    delivered = []
+    failed = 0
+
+    for letter in db.outbound_dead_letters.find().sort("created_at", 1).limit(limit):
+        bucket.acquire()
+        try:
+            client.send_message(letter["payload"])
+            delivered.append(letter["_id"])
+        except Exception as e:
+            failed += 1
+            db.outbound_dead_letters.update_one(
+                {"_id": letter["_id"]},
+                {"$set": {"error": str(e), "replayed_at": datetime.datetime.utcnow()}, "$inc": {"attempts": 1}}
+            )
+
+    if delivered:
+        db.outbound_dead_letters.delete_many({"_id": {"$in": delivered}})
+    return len(delivered), failed
+
+outbound_dispatcher = OutboundDispatcher()
@@ -0,0 +1,173 @@
+import datetime
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from app.config import Config
+from app.database import get_db
+from app.services.graph_client import get_graph_client
+from app.services.outbound_dispatcher import TokenBucket, backoff_delay
+
+# Notifications are written to the outbox in the same transaction as the
+# state change they announce, and a relay delivers them afterwards.
+# Status lifecycle: pending -> sending -> sent | pending (retry) | failed
+
+def ensure_indexes():
+    db = get_db()
+    db.notification_outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+    # Delivered entries are only kept for a week
+    db.notification_outbox.create_index("sent_at", expireAfterSeconds=7 * 24 * 3600)
+
+def run_in_transaction(operation):
+    """
+    Runs operation(session) inside a MongoDB transaction. Standalone
+    servers without transaction support run it without one.
+    """
+    client = get_db().client
+    try:
+        with client.start_session() as session:
+            return session.with_transaction(operation)
+    except OperationFailure as e:
+        # IllegalOperation: transactions need a replica set or mongos
+        if e.code != 20:
+            raise
+        print("WARNING: MongoDB transactions unavailable, writing outbox without one")
+        return operation(None)
+
+def enqueue_notifications(notifications, session=None):
+    """
+    Writes outbox entries. Each notification is {"recipient", "payload",
+    "kind", "ref"}; pass the transaction session to make the write part
+    of the caller's state change. Returns the outbox ids.
+    """
+    if not notifications:
+        return []
+    db = get_db()
+    now = datetime.datetime.utcnow()
+    docs = [{
+        "recipient": n["recipient"],
+        "payload": n["payload"],
+        "kind": n.get("kind", "message"),
+        "ref": n.get("ref"),
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now
+    } for n in notifications]
+    result = db.notification_outbox.insert_many(docs, session=session)
+    return result.inserted_ids
+
+def _claim(limit, ids=None):
+    """
+    Leases up to `limit` due entries for this relay pass.
+    Entries whose lease expired (relay crashed mid-send) are claimable again.
+    """
+    db = get_db()
+    now = datetime.datetime.utcnow()
+    lease_id = uuid.uuid4().hex
+    due = {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        {"status": "sending", "lease_until": {"$lte": now}}
+    ]}
+    if ids is not None:
+        due = {"$and": [due, {"_id": {"$in": list(ids)}}]}
+
+    candidates = [d["_id"] for d in db.notification_outbox.find(due, {"_id": 1}).limit(limit)]
+    if not candidates:
+        return []
+    db.notification_outbox.update_many(
+        {"$and": [due, {"_id": {"$in": candidates}}]},
+        {"$set": {
+            "status": "sending",
+            "lease_id": lease_id,
+            "lease_until": now + datetime.timedelta(seconds=Config.OUTBOX_LEASE_SECONDS)
+        }}
+    )
+    return list(db.notification_outbox.find({"lease_id": lease_id, "status": "sending"}))
+
+def _deliver(entry, bucket):
+    bucket.acquire()
+    try:
+        get_graph_client().send_message(entry["payload"])
+        return None
+    except Exception as e:
+        if hasattr(e, 'response') and e.response is not None:
+            return f"{e}: {e.response.text}"
+        return str(e)
+
+def drain(limit=None, ids=None):
+    """
+    Delivers one batch of due outbox entries concurrently and records the
+    outcome with a single bulk_write. Returns {ref: delivered}.
+    """
+    entries = _claim(limit or Config.OUTBOX_BATCH_SIZE, ids)
+    if not entries:
+        return {}
+
+    bucket = TokenBucket(Config.WHATSAPP_SEND_RATE, Config.WHATSAPP_SEND_BURST)
+    with ThreadPoolExecutor(max_workers=min(Config.NOTIFY_POOL_SIZE, len(entries))) as pool:
+        errors = list(pool.map(lambda entry: _deliver(entry, bucket), entries))
+
+    now = datetime.datetime.utcnow()
+    operations = []
+    results = {}
+    for entry, error in zip(entries, errors):
+        results[entry.get("ref")] = error is None
+        if error is None:
+            operations.append(UpdateOne({"_id": entry["_id"]}, {
+                "$set": {"status": "sent", "sent_at": now},
+                "$unset": {"lease_id": "", "lease_until": ""}
+            }))
+            continue
+
+        attempts = entry.get("attempts", 0) + 1
+        print(f"Error delivering outbox {entry['kind']} to {entry['recipient']}: {error}", flush=True)
+        operations.append(UpdateOne({"_id": entry["_id"]}, {
+            "$set": {
+                "status": "failed" if attempts >= Config.OUTBOX_MAX_ATTEMPTS else "pending",
+                "attempts": attempts,
+                "error": error,
+                "next_attempt_at": now + datetime.timedelta(seconds=backoff_delay(attempts))
+            },
+            "$unset": {"lease_id": "", "lease_until": ""}
+        }))
+
+    get_db().notification_outbox.bulk_write(operations, ordered=False)
+    return results
+
+class OutboxRelay:
+    """
+    Background thread that keeps draining the outbox.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.thread = None
+        self.started = False
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        with self._lock:
+            if self.started:
+                return
+            self.app = app
+            self.thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+            self.thread.start()
+            self.started = True
+            print("DEBUG: Outbox relay started", flush=True)
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    delivered = drain()
+            except Exception as e:
+                print(f"Error in outbox relay: {e}", flush=True)
+                delivered = {}
+            # Keep going while there is a backlog, otherwise poll
+            if not delivered:
+                time.sleep(Config.OUTBOX_POLL_INTERVAL)
+
+outbox_relay = OutboxRelay()
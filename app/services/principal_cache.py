@@ -0,0 +1,29 @@
+from bson import ObjectId
+from app.config import Config
+from app.database import get_db
+from app.services.response_cache import TTLCache
+
+# Users resolved from JWTs by token_required, keyed on user id. Only the
+# fields routes read are loaded (never the password hash). Invalidation is
+# per process, so other workers see a change within PRINCIPAL_CACHE_TTL_SECONDS.
+
+PRINCIPAL_PROJECTION = {"name": 1, "role": 1, "email": 1, "wa_id": 1}
+
+_principals = TTLCache(Config.PRINCIPAL_CACHE_SIZE, Config.PRINCIPAL_CACHE_TTL_SECONDS)
+
+def get_principal(user_id):
+    """
+    The user for a JWT's user_id, from the cache or one projected lookup.
+    Returns None if the user does not exist.
+    """
+    user = _principals.get(user_id)
+    if user is None:
+        db = get_db()
+        user = db.users.find_one({"_id": ObjectId(user_id)}, PRINCIPAL_PROJECTION)
+        if not user:
+            return None
+        _principals.set(user_id, user)
+    return dict(user)
+
+def invalidate_principal(user_id):
+    _principals.delete(str(user_id))
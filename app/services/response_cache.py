@@ -0,0 +1,113 @@
+import datetime
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from app.config import Config
+from app.database import get_db
+
+# Caches AI replies for repeated prompts. Keys combine the normalized
+# message, the prompt fingerprint and the risk level the reply was written
+# for. Crisis messages are never looked up or stored.
+
+BYPASS_RISK_LEVELS = {"CRITICAL"}
+
+_PUNCTUATION = re.compile(r"[^\w\s']")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_message(text):
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+def prompt_fingerprint(prompt):
+    """
+    Short stable id for a prompt, so editing it invalidates old entries.
+    """
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+
+def cache_key(prompt_version, text, risk_level):
+    raw = f"{prompt_version}|{risk_level}|{normalize_message(text)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU whose entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_local = TTLCache(Config.AI_CACHE_MAX_SIZE, Config.AI_CACHE_TTL_SECONDS)
+
+def ensure_indexes():
+    db = get_db()
+    db.ai_response_cache.create_index("expires_at", expireAfterSeconds=0)
+
+def get_cached_response(prompt_version, text, risk_level):
+    """
+    Looks the reply up in the in-process tier, then the shared Mongo tier.
+    """
+    if not Config.AI_CACHE_ENABLED or risk_level in BYPASS_RISK_LEVELS:
+        return None
+    key = cache_key(prompt_version, text, risk_level)
+    value = _local.get(key)
+    if value is not None or not Config.AI_CACHE_SHARED:
+        return value
+
+    try:
+        doc = get_db().ai_response_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.datetime.utcnow()}})
+    except Exception as e:
+        print(f"WARNING: Shared AI cache read failed: {e}")
+        return None
+    if doc:
+        _local.set(key, doc["response"])
+        return doc["response"]
+    return None
+
+def set_cached_response(prompt_version, text, risk_level, response):
+    if not Config.AI_CACHE_ENABLED or risk_level in BYPASS_RISK_LEVELS or not response:
+        return
+    key = cache_key(prompt_version, text, risk_level)
+    _local.set(key, response)
+    if not Config.AI_CACHE_SHARED:
+        return
+
+    try:
+        get_db().ai_response_cache.update_one({"_id": key}, {"$set": {
+            "response": response,
+            "risk_level": risk_level,
+            "expires_at": datetime.datetime.utcnow() + datetime.timedelta(seconds=Config.AI_CACHE_TTL_SECONDS)
+        }}, upsert=True)
+    except Exception as e:
+        print(f"WARNING: Shared AI cache write failed: {e}")
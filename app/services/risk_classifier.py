@@ -0,0 +1,161 @@
+import json
+import math
+import os
+import re
+from app.config import Config
+
+# Tier 1: precompiled lexicon. CRITICAL phrases resolve immediately (and
+# keep crisis detection working when Gemini is down); severe or moderate
+# distress markers mean the message must go to Gemini. Only mild academic
+# stress with no distress markers and no finality, negation or absence
+# wording resolves as LOW; indirect hints ("don't want to be here
+# anymore") read as exam stress to a lexicon, so Gemini decides those.
+
+CRITICAL_PATTERN = re.compile(r"""
+    \b(?:
+        suicid\w*
+      | kill(?:ing)?\s+my\s*self
+      | end(?:ing)?\s+(?:it\s+all|my\s+life|everything)
+      | take\s+my\s+(?:own\s+)?life
+      | (?:want|wanna|going)\s+(?:to\s+)?die
+      | better\s+off\s+dead
+      | no\s+(?:reason|point)\s+(?:to|in)\s+(?:live|living|being\s+alive)
+      | self[\s-]?harm\w*
+      | (?:cut|hurt|harm)(?:ting)?\s+my\s*self
+      | disappear\s+(?:forever|permanently)
+      | don'?t\s+want\s+to\s+(?:be\s+alive|exist|live|wake\s+up)
+      | not\s+worth\s+living
+      | overdose
+    )\b
+""", re.IGNORECASE | re.VERBOSE)
+
+SEVERE_PATTERN = re.compile(r"""
+    \b(?:
+        can'?t\s+(?:do\s+this|take\s+(?:it|this)|go\s+on)
+      | hopeless\w* | worthless | empty | numb
+      | falling\s+apart | breaking\s+down
+      | give\s+up | giving\s+up | pointless | meaningless
+    )\b
+""", re.IGNORECASE | re.VERBOSE)
+
+DISTRESS_PATTERN = re.compile(r"""
+    \b(?:
+        can'?t\s+(?:cope|handle|focus|sleep)
+      | lost | break\s*down
+      | anxi\w* | panic\w* | overwhelm\w* | burn(?:ed|t)?\s*out
+      | crying | cried | depress\w* | alone | lonely
+      | scared | terrified | miserable | exhausted
+    )\b
+""", re.IGNORECASE | re.VERBOSE)
+
+# Indirect suicidal hints; treated as severe when Gemini cannot be reached
+HINT_PATTERN = re.compile(r"""
+    \b(?:
+        (?:not|never|(?:don|doesn|didn|can|couldn|wouldn|won|isn|wasn)'?t)\s+(?:\w+\s+){0,3}(?:be\s+here|be\s+around|wake\s+up|come\s+back)
+      | (?:be|was|were|am|i'?m)\s+gone
+      | end(?:ing|ed)?\s+(?:it|things)
+      | (?:it|everything|it\s+all)\s+to\s+(?:stop|end)
+      | (?:sleep|disappear|gone)\s+forever
+      | (?:nobody|no\s+one|no-one)\s+(?:would|will|'?d)\s+(?:care|notice|miss)
+      | tired\s+of\s+(?:everything|life|living|it\s+all|being\s+alive)
+      | no\s+way\s+out | a\s+burden | say(?:ing)?\s+goodbye
+    )\b
+""", re.IGNORECASE | re.VERBOSE)
+
+# Finality, negation or absence wording; any of it keeps a message off the
+# local LOW path
+GUARD_PATTERN = re.compile(r"""
+    \b(?:
+        not|no|never|nobody|nothing|anymore|gone|stop\w*|forever|end\w*|without|leave|away
+      | (?:don|doesn|didn|can|couldn|wouldn|shouldn|won|isn|aren|wasn|weren|haven|hasn)'?t
+    )\b
+""", re.IGNORECASE | re.VERBOSE)
+
+MILD_PATTERN = re.compile(r"""
+    \b(?:
+        exams? | tests? | quiz(?:zes)? | assignments? | deadlines? | homework
+      | projects? | studying | study | grades? | class(?:es)? | lectures?
+      | stress(?:ed|ful)? | worried | nervous | tired | busy | bit | little
+    )\b
+""", re.IGNORECASE | re.VERBOSE)
+
+# Longer messages carry more context than a lexicon can judge
+MILD_MAX_WORDS = 40
+
+TOKEN_PATTERN = re.compile(r"[a-z']+")
+
+class NaiveBayesRiskModel:
+    """
+    Multinomial naive Bayes trained offline by scripts/train_risk_model.py.
+    """
+
+    def __init__(self, priors, likelihoods, unknown):
+        self.priors = priors
+        self.likelihoods = likelihoods
+        self.unknown = unknown
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            params = json.load(f)
+        return cls(params["priors"], params["likelihoods"], params["unknown"])
+
+    def predict(self, text):
+        """
+        Returns (label, posterior probability).
+        """
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        scores = {}
+        for label, prior in self.priors.items():
+            table = self.likelihoods[label]
+            unknown = self.unknown[label]
+            scores[label] = prior + sum(table.get(token, unknown) for token in tokens)
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / norm
+
+_model = None
+_model_loaded = False
+
+def _get_model():
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        path = Config.RISK_MODEL_PATH
+        if path and os.path.exists(path):
+            try:
+                _model = NaiveBayesRiskModel.load(path)
+                print(f"DEBUG: Loaded local risk model from {path}")
+            except Exception as e:
+                print(f"WARNING: Could not load risk model {path}: {e}")
+    return _model
+
+def fast_classify(text):
+    """
+    Local pre-classification of a message.
+    Returns (level, confident). When confident is False the level is only a
+    best guess to fall back on if Gemini cannot be reached.
+    """
+    if CRITICAL_PATTERN.search(text):
+        return "CRITICAL", True
+
+    severe = SEVERE_PATTERN.search(text) is not None or HINT_PATTERN.search(text) is not None
+    distressed = severe or DISTRESS_PATTERN.search(text) is not None
+    guarded = distressed or GUARD_PATTERN.search(text) is not None
+    if not guarded and MILD_PATTERN.search(text) and len(text.split()) <= MILD_MAX_WORDS:
+        return "LOW", True
+
+    model = _get_model()
+    if model is not None:
+        label, probability = model.predict(text)
+        if label in ("LOW", "CRITICAL") and probability >= Config.RISK_MODEL_THRESHOLD:
+            # Never let the model downgrade a message with distress markers
+            # or finality wording
+            if not (label == "LOW" and guarded):
+                return label, True
+        if distressed and label in ("HIGH", "CRITICAL"):
+            return label, False
+
+    if severe:
+        return "HIGH", False
+    return ("MODERATE" if distressed else "LOW"), False
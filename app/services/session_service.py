@@ -1,40 +1,533 @@
 from app.database import get_db
+from app.config import Config
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from collections import OrderedDict
+import atexit
+import copy
 import datetime
+import threading
+import time
+import uuid
+import zlib
 
-def get_user_session(wa_id):
+# Every write bumps `version`; the write-behind cache flushes with a
+# compare-and-swap on it, so a concurrent update from another gunicorn
+# worker is detected instead of lost.
+
+DUPLICATE_KEY_ERROR = 11000
+
+def ensure_indexes():
     """
-    Retrieves or creates a session for a WhatsApp ID.
+    One session document per WhatsApp ID. Idle sessions expire through a
+    TTL on updated_at, as a backstop for the archiver which normally moves
+    them out well before that.
     """
     db = get_db()
-    session = db.chat_sessions.find_one({"wa_id": wa_id})
-    
-    if not session:
-        session = {
-            "wa_id": wa_id,
-            "state": "START",
-            "data": {},
-            "updated_at": datetime.datetime.utcnow()
-        }
-        db.chat_sessions.insert_one(session)
-    
-    return session
+    try:
+        db.chat_sessions.create_index("wa_id", unique=True)
+    except OperationFailure as e:
+        # Only data written before the index existed can hold duplicates
+        if e.code != DUPLICATE_KEY_ERROR:
+            raise
+        remove_duplicate_sessions()
+        db.chat_sessions.create_index("wa_id", unique=True)
+    db.chat_sessions.create_index("updated_at", expireAfterSeconds=Config.SESSION_IDLE_TTL_SECONDS)
+    db.chat_sessions_archive.create_index("wa_id")
+    db.chat_sessions_archive.create_index("archived_at")
 
-def update_user_session(wa_id, state=None, data=None):
+def remove_duplicate_sessions():
     """
-    Updates the session state and/or temp data for a user.
+    Keeps only the most recently updated session per wa_id, so the unique
+    index can be built over data written before it existed. Scans the whole
+    collection; ensure_indexes only runs it when the index build fails.
     """
     db = get_db()
+    duplicates = db.chat_sessions.aggregate([
+        {"$sort": {"updated_at": -1, "_id": -1}},
+        {"$group": {"_id": "$wa_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    stale = [session_id for group in duplicates for session_id in group["ids"][1:]]
+    if stale:
+        result = db.chat_sessions.delete_many({"_id": {"$in": stale}})
+        print(f"WARNING: Removed {result.deleted_count} duplicate chat sessions", flush=True)
+
+def _new_session_fields():
+    return {
+        "state": "START",
+        "data": {},
+        "version": 0,
+        "updated_at": datetime.datetime.utcnow()
+    }
+
+def _version_filter(wa_id, version):
+    if not version:
+        # Sessions created before versioning have no version field
+        return {"wa_id": wa_id, "$or": [{"version": 0}, {"version": {"$exists": False}}]}
+    return {"wa_id": wa_id, "version": version}
+
+def _session_update(state, data, write_id=None):
     updates = {"updated_at": datetime.datetime.utcnow()}
-    
     if state:
         updates["state"] = state
     if data is not None:
         updates["data"] = data
-        
-    db.chat_sessions.update_one(
+    if write_id:
+        updates["write_id"] = write_id
+    return {"$set": updates, "$inc": {"version": 1}}
+
+class SessionCache:
+    """
+    Per-process write-behind cache of chat sessions (LRU with TTL).
+    Updates are applied in memory and marked dirty; a flusher thread writes
+    them back with one bulk_write every SESSION_FLUSH_INTERVAL seconds, so a
+    user tapping through several menus costs one Mongo write instead of one
+    per step. Entries are also flushed when evicted and at exit, and states
+    listed in SESSION_SYNC_STATES are written through immediately. A write
+    that fails (e.g. MongoDB briefly unreachable) stays dirty and is retried
+    by the next flush.
+
+    The flush is a compare-and-swap on the version last written, so if
+    another process changed the session meanwhile the cached copy is
+    dropped rather than overwriting it. Only worth enabling when messages
+    for a wa_id consistently reach the same worker.
+    """
+
+    def __init__(self, max_size, ttl, flush_interval, sync_states):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.sync_states = sync_states
+        self.app = None
+        self.thread = None
+        self.started = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        with self._lock:
+            if self.started:
+                return
+            self.app = app
+            self.thread = threading.Thread(target=self._run, name="session-flusher", daemon=True)
+            self.thread.start()
+            atexit.register(self.flush_all)
+            self.started = True
+            print("DEBUG: Session write-behind cache started", flush=True)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush_all()
+
+    def get(self, wa_id):
+        with self._lock:
+            entry = self._entries.get(wa_id)
+            if not entry or entry["expires"] <= time.monotonic():
+                return None
+            self._entries.move_to_end(wa_id)
+            # Handlers mutate session data in place; keep the cached copy intact
+            return copy.deepcopy(entry["doc"])
+
+    def put(self, doc):
+        """
+        Caches a session just read from MongoDB, unless this process holds
+        a newer copy.
+        """
+        with self._lock:
+            entry = self._entries.get(doc["wa_id"])
+            if entry and (entry["dirty"] or entry["doc"].get("version", 0) > doc.get("version", 0)):
+                return
+            self._entries[doc["wa_id"]] = {
+                "doc": copy.deepcopy(doc),
+                "stored_version": doc.get("version", 0),
+                "dirty": False,
+                "expires": time.monotonic() + self.ttl
+            }
+            self._entries.move_to_end(doc["wa_id"])
+            pending = self._evict()
+        self._write_back(pending)
+
+    def update(self, wa_id, state, data):
+        """
+        Applies an update in memory. Returns False if the session is not
+        cached.
+        """
+        with self._lock:
+            entry = self._entries.get(wa_id)
+            if not entry:
+                return False
+            doc = entry["doc"]
+            if state:
+                doc["state"] = state
+            if data is not None:
+                doc["data"] = copy.deepcopy(data)
+            doc["version"] = doc.get("version", 0) + 1
+            doc["updated_at"] = datetime.datetime.utcnow()
+            entry["dirty"] = True
+            entry["expires"] = time.monotonic() + self.ttl
+            self._entries.move_to_end(wa_id)
+            pending = [self._take(wa_id)] if doc.get("state") in self.sync_states else []
+        self._write_back(pending)
+        return True
+
+    def discard(self, wa_id):
+        with self._lock:
+            self._entries.pop(wa_id, None)
+
+    def _take(self, wa_id):
+        # Caller holds the lock; snapshots a dirty entry for writing
+        entry = self._entries[wa_id]
+        entry["dirty"] = False
+        snapshot = (wa_id, entry["stored_version"], copy.deepcopy(entry["doc"]))
+        entry["stored_version"] = entry["doc"]["version"]
+        return snapshot
+
+    def _restore(self, pending):
+        # Undoes _take for snapshots whose write failed, so they stay dirty
+        # and the next flush retries them with the right expected version
+        with self._lock:
+            for wa_id, stored_version, doc in pending:
+                entry = self._entries.get(wa_id)
+                if entry is None:
+                    # Evicted while being written; keep it until it is stored
+                    self._entries[wa_id] = {
+                        "doc": doc,
+                        "stored_version": stored_version,
+                        "dirty": True,
+                        "expires": time.monotonic() + self.ttl
+                    }
+                elif entry["stored_version"] == doc["version"]:
+                    entry["stored_version"] = stored_version
+                    entry["dirty"] = True
+
+    def _evict(self):
+        # Caller holds the lock; returns dirty entries that still need writing
+        now = time.monotonic()
+        doomed = [wa_id for wa_id, entry in self._entries.items() if entry["expires"] <= now]
+        overflow = len(self._entries) - len(doomed) - self.max_size
+        if overflow > 0:
+            doomed += [wa_id for wa_id in self._entries if wa_id not in doomed][:overflow]
+        pending = []
+        for wa_id in doomed:
+            if self._entries[wa_id]["dirty"]:
+                pending.append(self._take(wa_id))
+            del self._entries[wa_id]
+        return pending
+
+    def flush_all(self):
+        with self._lock:
+            pending = [self._take(wa_id) for wa_id, entry in self._entries.items() if entry["dirty"]]
+            pending += self._evict()
+        if not pending:
+            return
+        with self.app.app_context():
+            self._write_back(pending)
+
+    def _write_back(self, pending):
+        # A failed write is kept dirty and retried by the next flush
+        try:
+            self._write(pending)
+        except Exception as e:
+            print(f"Error flushing session cache: {e}", flush=True)
+
+    def _write(self, pending):
+        if not pending:
+            return
+        db = get_db()
+        operations = [
+            UpdateOne(_version_filter(wa_id, stored_version), {"$set": {
+                "state": doc.get("state"),
+                "data": doc.get("data"),
+                "version": doc["version"],
+                "updated_at": doc["updated_at"]
+            }})
+            for wa_id, stored_version, doc in pending
+        ]
+        try:
+            result = db.chat_sessions.bulk_write(operations, ordered=False)
+        except Exception:
+            self._restore(pending)
+            raise
+        if result.matched_count == len(operations):
+            return
+
+        # Changed elsewhere (or deleted) since it was cached: drop our copy
+        written = {s["wa_id"] for s in db.chat_sessions.find(
+            {"$or": [{"wa_id": wa_id, "version": doc["version"]} for wa_id, _, doc in pending]}, {"wa_id": 1}
+        )}
+        for wa_id, _, _ in pending:
+            if wa_id not in written:
+                print(f"WARNING: Session for {wa_id} changed elsewhere; dropping cached update", flush=True)
+                self.discard(wa_id)
+
+session_cache = SessionCache(
+    Config.SESSION_CACHE_SIZE,
+    Config.SESSION_CACHE_TTL_SECONDS,
+    Config.SESSION_FLUSH_INTERVAL,
+    set(Config.SESSION_SYNC_STATES)
+)
+
+def get_user_session(wa_id):
+    """
+    Retrieves or atomically creates a session for a WhatsApp ID.
+    """
+    if session_cache.started:
+        cached = session_cache.get(wa_id)
+        if cached:
+            return cached
+    db = get_db()
+    session = db.chat_sessions.find_one_and_update(
         {"wa_id": wa_id},
-        {"$set": updates}
+        {"$setOnInsert": _new_session_fields()},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
+    if session_cache.started:
+        session_cache.put(session)
+    return session
+
+def get_user_sessions(wa_ids):
+    """
+    Retrieves sessions for several WhatsApp IDs with a single $in query.
+    Missing sessions are created with one bulk upsert and read back, so the
+    cost stays constant regardless of how many senders are in the batch.
+    """
+    wa_ids = list(dict.fromkeys(wa_ids))
+    sessions = {}
+    if session_cache.started:
+        for wa_id in wa_ids:
+            cached = session_cache.get(wa_id)
+            if cached:
+                sessions[wa_id] = cached
+        wa_ids = [wa_id for wa_id in wa_ids if wa_id not in sessions]
+        if not wa_ids:
+            return sessions
+
+    db = get_db()
+    loaded = {s["wa_id"]: s for s in db.chat_sessions.find({"wa_id": {"$in": wa_ids}})}
+
+    missing = [wa_id for wa_id in wa_ids if wa_id not in loaded]
+    if missing:
+        db.chat_sessions.bulk_write([
+            UpdateOne({"wa_id": wa_id}, {"$setOnInsert": _new_session_fields()}, upsert=True)
+            for wa_id in missing
+        ], ordered=False)
+        for s in db.chat_sessions.find({"wa_id": {"$in": missing}}):
+            loaded[s["wa_id"]] = s
+
+    if session_cache.started:
+        for session in loaded.values():
+            session_cache.put(session)
+    sessions.update(loaded)
+    return sessions
+
+def update_user_session(wa_id, state=None, data=None):
+    """
+    Updates the session state and/or temp data for a user.
+    """
+    if session_cache.started and session_cache.update(wa_id, state, data):
+        return
+    db = get_db()
+    db.chat_sessions.update_one({"wa_id": wa_id}, _session_update(state, data))
+
+# Leases serialize processing per wa_id: handlers have side effects
+# (bookings, approvals, outbox entries), so a sender's messages must never
+# be run twice because another worker touched the session meanwhile.
+_LEASE_FIELDS = {"lease_owner": "", "lease_until": ""}
+_local_locks = [threading.Lock() for _ in range(64)]
+_local_leases = {}
+
+def _local_lock(wa_id):
+    return _local_locks[zlib.crc32(str(wa_id).encode("utf-8")) % len(_local_locks)]
+
+def lease_user_sessions(wa_ids, wait=None):
+    """
+    Takes exclusive leases on the sessions of several WhatsApp IDs and
+    returns (lease_id, {wa_id: session}). Leases held elsewhere are waited
+    for up to `wait` seconds (SESSION_LEASE_WAIT_SECONDS by default; pass 0
+    on a request thread); senders still unavailable then are left out of
+    the result. Pass lease_id to save_leased_sessions.
+    """
+    lease_id = uuid.uuid4().hex
+    wa_ids = list(dict.fromkeys(wa_ids))
+    deadline = time.monotonic() + (Config.SESSION_LEASE_WAIT_SECONDS if wait is None else wait)
+    if session_cache.started:
+        # The cache is authoritative in-process; a local lock is enough
+        by_lock = {}
+        for wa_id in wa_ids:
+            by_lock.setdefault(_local_lock(wa_id), []).append(wa_id)
+        held = []
+        for lock in sorted(by_lock, key=id):
+            if lock.acquire(timeout=max(0, deadline - time.monotonic())):
+                held.append(lock)
+        _local_leases[lease_id] = held
+        leased = [wa_id for wa_id in wa_ids if _local_lock(wa_id) in held]
+        if len(leased) < len(wa_ids):
+            print(f"WARNING: Could not lease sessions for {[w for w in wa_ids if w not in leased]}", flush=True)
+        try:
+            return lease_id, get_user_sessions(leased) if leased else {}
+        except Exception:
+            for lock in _local_leases.pop(lease_id):
+                lock.release()
+            raise
+
+    db = get_db()
+    sessions = {}
+    pending = wa_ids
+    delay = 0.05
+    while pending:
+        now = datetime.datetime.utcnow()
+        until = now + datetime.timedelta(seconds=Config.SESSION_LEASE_SECONDS)
+        db.chat_sessions.update_many(
+            {"wa_id": {"$in": pending}, "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}]},
+            {"$set": {"lease_owner": lease_id, "lease_until": until}}
+        )
+        found = set()
+        for doc in db.chat_sessions.find({"wa_id": {"$in": pending}}):
+            found.add(doc["wa_id"])
+            if doc.get("lease_owner") == lease_id:
+                sessions[doc["wa_id"]] = doc
+
+        missing = [wa_id for wa_id in pending if wa_id not in found]
+        if missing:
+            # New senders: create the session already leased
+            try:
+                db.chat_sessions.bulk_write([
+                    UpdateOne({"wa_id": wa_id}, {"$setOnInsert": dict(_new_session_fields(), lease_owner=lease_id, lease_until=until)}, upsert=True)
+                    for wa_id in missing
+                ], ordered=False)
+            except BulkWriteError as e:
+                # Created by another worker meanwhile; leased on the next pass
+                if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+                    raise
+            for doc in db.chat_sessions.find({"wa_id": {"$in": missing}, "lease_owner": lease_id}):
+                sessions[doc["wa_id"]] = doc
+
+        pending = [wa_id for wa_id in pending if wa_id not in sessions]
+        if pending:
+            if time.monotonic() >= deadline:
+                print(f"WARNING: Could not lease sessions for {pending}", flush=True)
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+    return lease_id, sessions
+
+def save_leased_sessions(lease_id, updates, release=()):
+    """
+    Writes session updates taken under lease_id and releases the leases.
+    `updates` maps wa_id -> {"state": ..., "data": ...}; wa_ids in `release`
+    are only unlocked. Returns the wa_ids whose lease had expired and been
+    taken over, so their update was not written.
+    """
+    if session_cache.started:
+        try:
+            for wa_id, update in updates.items():
+                update_user_session(wa_id, update.get("state"), update.get("data"))
+        finally:
+            for lock in _local_leases.pop(lease_id, []):
+                lock.release()
+        return []
+
+    operations = []
+    for wa_id, update in updates.items():
+        change = _session_update(update.get("state"), update.get("data"), lease_id)
+        change["$unset"] = _LEASE_FIELDS
+        operations.append(UpdateOne({"wa_id": wa_id, "lease_owner": lease_id}, change))
+    for wa_id in release:
+        if wa_id not in updates:
+            operations.append(UpdateOne({"wa_id": wa_id, "lease_owner": lease_id}, {"$unset": _LEASE_FIELDS}))
+    if not operations:
+        return []
+
+    db = get_db()
+    result = db.chat_sessions.bulk_write(operations, ordered=False)
+    if result.matched_count == len(operations):
+        return []
+    # Sessions deleted meanwhile (e.g. TEST REGISTRATION) are not lost updates
+    return [s["wa_id"] for s in db.chat_sessions.find(
+        {"wa_id": {"$in": list(updates)}, "write_id": {"$ne": lease_id}}, {"wa_id": 1}
+    )]
+
+def delete_user_session(wa_id):
+    """
+    Deletes the session document and any cached copy of it.
+    """
+    session_cache.discard(wa_id)
+    get_db().chat_sessions.delete_one({"wa_id": wa_id})
+
+def archive_stale_sessions(limit=None, batch_size=None):
+    """
+    Moves sessions idle for SESSION_ARCHIVE_AFTER_SECONDS to
+    chat_sessions_archive in bounded batches. Each batch is copied first and
+    then deleted only if it is still idle, so a user who comes back mid-run
+    keeps their session; a returning user whose session was archived simply
+    starts again at START. Returns the number of sessions archived.
+    """
+    db = get_db()
+    batch_size = batch_size or Config.SESSION_ARCHIVE_BATCH_SIZE
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=Config.SESSION_ARCHIVE_AFTER_SECONDS)
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        stale = list(db.chat_sessions.find({"updated_at": {"$lt": cutoff}}).sort("updated_at", 1).limit(size))
+        if not stale:
+            break
+
+        now = datetime.datetime.utcnow()
+        # Upsert by _id: a copy left by an earlier run that stopped before
+        # deleting is replaced with the current snapshot, not kept
+        db.chat_sessions_archive.bulk_write([
+            ReplaceOne({"_id": doc["_id"]}, dict(doc, archived_at=now), upsert=True)
+            for doc in stale
+        ], ordered=False)
+
+        result = db.chat_sessions.delete_many({
+            "_id": {"$in": [doc["_id"] for doc in stale]},
+            "updated_at": {"$lt": cutoff}
+        })
+        for doc in stale:
+            session_cache.discard(doc["wa_id"])
+        archived += result.deleted_count
+        if len(stale) < size:
+            break
+    return archived
+
+class SessionArchiver:
+    """
+    Background thread that archives idle sessions every
+    SESSION_ARCHIVE_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.thread = None
+        self.started = False
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        with self._lock:
+            if self.started:
+                return
+            self.app = app
+            self.thread = threading.Thread(target=self._run, name="session-archiver", daemon=True)
+            self.thread.start()
+            self.started = True
+            print("DEBUG: Session archiver started", flush=True)
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    archived = archive_stale_sessions()
+                if archived:
+                    print(f"DEBUG: Archived {archived} idle sessions", flush=True)
+            except Exception as e:
+                print(f"Error in session archiver: {e}", flush=True)
+            time.sleep(Config.SESSION_ARCHIVE_INTERVAL)
+
+session_archiver = SessionArchiver()
 
 def clear_user_session(wa_id):
     """
@@ -0,0 +1,217 @@
+import datetime
+import threading
+import time
+from pymongo.errors import DuplicateKeyError
+from app.config import Config
+from app.database import get_db
+
+# Bookable counseling slots derived from doctor availability.
+# A slot is (doctor_wa_id, date, time). Bookings that hold a slot carry
+# slot_active=True, and a unique partial index on the slot fields lets
+# MongoDB reject double bookings even across gunicorn workers; the
+# in-process SlotIndex only decides what to offer.
+
+BOOKING_DAYS = 7
+MAX_TIME_ROWS = 10
+# Offered for doctors who registered without availability (the old fixed menu)
+DEFAULT_TIMES = ["09:00", "11:00", "14:00", "16:00", "19:00"]
+
+def ensure_indexes():
+    """
+    One active booking per doctor, date and time.
+    """
+    db = get_db()
+    db.counseling_sessions.create_index(
+        [("doctor_wa_id", 1), ("date", 1), ("time", 1)],
+        unique=True,
+        partialFilterExpression={"slot_active": True},
+        name="one_booking_per_slot"
+    )
+
+def _parse_date(value):
+    if not value:
+        return None
+    value = str(value)
+    try:
+        if value.isdigit():
+            # Flow date pickers may return epoch milliseconds
+            return datetime.datetime.utcfromtimestamp(int(value) / 1000).date()
+        return datetime.date.fromisoformat(value[:10])
+    except (ValueError, OverflowError):
+        return None
+
+def _parse_minutes(value):
+    hours, minutes = value.strip().split(":")
+    return int(hours) * 60 + int(minutes[:2])
+
+def _expand_times(available_times):
+    """
+    Turns ["09:00 - 17:00"] style ranges into hourly start times.
+    """
+    times = set()
+    for entry in available_times or []:
+        try:
+            if "-" in entry:
+                start, end = (_parse_minutes(part) for part in entry.split("-", 1))
+                for minute in range(start, end - 59, 60):
+                    times.add(f"{minute // 60:02d}:{minute % 60:02d}")
+            else:
+                minute = _parse_minutes(entry)
+                times.add(f"{minute // 60:02d}:{minute % 60:02d}")
+        except ValueError:
+            print(f"WARNING: Ignoring unreadable availability '{entry}'", flush=True)
+    return sorted(times) or DEFAULT_TIMES
+
+def doctor_times_on(doctor, day):
+    """
+    The start times a doctor offers on `day` (a date), or [] if none.
+    """
+    listed = [d for d in (_parse_date(v) for v in doctor.get("available_dates") or []) if d]
+    if listed and day not in listed:
+        return []
+    start = _parse_date(doctor.get("available_from_date"))
+    end = _parse_date(doctor.get("available_to_date"))
+    if (start and day < start) or (end and day > end):
+        return []
+    return _expand_times(doctor.get("available_times"))
+
+class SlotIndex:
+    """
+    Per-day map of time -> doctors with that slot free, built from doctor
+    availability minus active bookings. Days are loaded in one pass and
+    kept for a short TTL; bookings and cancellations made by this process
+    update them in place, and anything missed from other workers is caught
+    by the unique index and picked up on the next reload.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def _load(self, dates):
+        now = time.monotonic()
+        with self._lock:
+            missing = [d for d in dates if d not in self._days or self._days[d][0] <= now]
+        if not missing:
+            return
+
+        db = get_db()
+        doctors = list(db.users.find(
+            {"role": "Doctor", "status": {"$ne": "Inactive"}},
+            {"wa_id": 1, "available_from_date": 1, "available_to_date": 1, "available_dates": 1, "available_times": 1}
+        ))
+        booked = set()
+        for sess in db.counseling_sessions.find(
+            {"date": {"$in": missing}, "slot_active": True},
+            {"doctor_wa_id": 1, "date": 1, "time": 1}
+        ):
+            booked.add((sess.get("doctor_wa_id"), sess["date"], sess["time"]))
+
+        loaded = {}
+        for date_str in missing:
+            day = datetime.date.fromisoformat(date_str)
+            free = {}
+            for doctor in doctors:
+                for slot_time in doctor_times_on(doctor, day):
+                    if (doctor["wa_id"], date_str, slot_time) not in booked:
+                        free.setdefault(slot_time, []).append(doctor["wa_id"])
+            loaded[date_str] = (now + self.ttl, free)
+
+        with self._lock:
+            self._days.update(loaded)
+
+    def free_times(self, date_str, not_before=None):
+        """
+        Sorted times on date_str with at least one free doctor.
+        """
+        self._load([date_str])
+        with self._lock:
+            free = self._days[date_str][1]
+            return sorted(t for t, doctors in free.items() if doctors and (not not_before or t >= not_before))
+
+    def dates_with_slots(self, dates, not_before=None):
+        """
+        The subset of dates (YYYY-MM-DD) that still have a free slot.
+        `not_before` maps a date to the earliest time still bookable on it.
+        """
+        self._load(dates)
+        not_before = not_before or {}
+        with self._lock:
+            return [d for d in dates if any(
+                doctors and t >= not_before.get(d, "") for t, doctors in self._days[d][1].items()
+            )]
+
+    def candidates(self, date_str, slot_time):
+        self._load([date_str])
+        with self._lock:
+            return list(self._days[date_str][1].get(slot_time, []))
+
+    def claim(self, date_str, slot_time, doctor_wa_id):
+        with self._lock:
+            day = self._days.get(date_str)
+            if day and doctor_wa_id in day[1].get(slot_time, []):
+                day[1][slot_time].remove(doctor_wa_id)
+
+    def release(self, date_str, slot_time, doctor_wa_id):
+        with self._lock:
+            day = self._days.get(date_str)
+            if day and doctor_wa_id not in day[1].setdefault(slot_time, []):
+                day[1][slot_time].append(doctor_wa_id)
+
+    def invalidate(self, date_str=None):
+        with self._lock:
+            if date_str:
+                self._days.pop(date_str, None)
+            else:
+                self._days.clear()
+
+slot_index = SlotIndex(Config.SLOT_CACHE_TTL_SECONDS)
+
+def _now():
+    now = datetime.datetime.now()
+    return now.strftime("%Y-%m-%d"), now.strftime("%H:%M")
+
+def bookable_dates():
+    """
+    Dates within the booking window that have at least one free slot.
+    """
+    today, now_time = _now()
+    start = datetime.date.fromisoformat(today)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(BOOKING_DAYS)]
+    return slot_index.dates_with_slots(dates, {today: now_time})
+
+def bookable_times(date_str):
+    """
+    Free times on date_str, capped to what fits in one WhatsApp list.
+    """
+    today, now_time = _now()
+    return slot_index.free_times(date_str, now_time if date_str == today else None)[:MAX_TIME_ROWS]
+
+def book_slot(session_doc):
+    """
+    Inserts a booking into the first doctor's slot still free at its date
+    and time. Returns the inserted document, or None if every doctor's slot
+    was taken meanwhile.
+    """
+    db = get_db()
+    date_str, slot_time = session_doc["date"], session_doc["time"]
+    for doctor_wa_id in slot_index.candidates(date_str, slot_time):
+        doc = dict(session_doc, doctor_wa_id=doctor_wa_id, slot_active=True)
+        try:
+            db.counseling_sessions.insert_one(doc)
+        except DuplicateKeyError:
+            # Booked through another worker since the day was loaded
+            slot_index.claim(date_str, slot_time, doctor_wa_id)
+            continue
+        slot_index.claim(date_str, slot_time, doctor_wa_id)
+        return doc
+    return None
+
+def release_slot(sess):
+    """
+    Frees the slot held by a declined or cancelled session, if it held one.
+    The caller must already have cleared slot_active on the document.
+    """
+    if sess and sess.get("slot_active") and sess.get("doctor_wa_id"):
+        slot_index.release(sess["date"], sess["time"], sess["doctor_wa_id"])
@@ -0,0 +1,91 @@
+import queue
+import threading
+import zlib
+from app.config import Config
+from app.services.webhook_service import process_messages
+
+class WebhookWorkerPool:
+    """
+    Background workers that drain inbound WhatsApp messages off the webhook
+    request thread.
+
+    Each worker owns its own queue and messages are routed by a stable hash
+    of the sender's wa_id, so every message from one user is processed by the
+    same worker in arrival order while different users run in parallel.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.queues = []
+        self.threads = []
+        self.started = False
+        self._lock = threading.Lock()
+
+    def start(self, app, worker_count=None, queue_size=None):
+        """
+        Starts the worker threads. Must run inside each serving process
+        (i.e. not before a gunicorn --preload fork).
+        """
+        with self._lock:
+            if self.started:
+                return
+            self.app = app
+            worker_count = worker_count or Config.WHATSAPP_WORKER_COUNT
+            queue_size = queue_size or Config.WHATSAPP_QUEUE_SIZE
+
+            for i in range(worker_count):
+                q = queue.Queue(maxsize=queue_size)
+                t = threading.Thread(target=self._run, args=(q,), name=f"webhook-worker-{i}", daemon=True)
+                self.queues.append(q)
+                self.threads.append(t)
+                t.start()
+            self.started = True
+            print(f"DEBUG: Webhook worker pool started with {worker_count} workers", flush=True)
+
+    def _shard(self, wa_id):
+        return self.queues[zlib.crc32(str(wa_id).encode("utf-8")) % len(self.queues)]
+
+    def submit(self, inbound, timeout=None):
+        """
+        Enqueues a normalized message, waiting up to `timeout` seconds for
+        room in the sender's queue. Returns False if the pool is not running
+        or the queue stayed full; the message must then not be processed
+        anywhere else, or it would overtake the sender's queued messages.
+        """
+        if not self.started:
+            return False
+        if timeout is None:
+            timeout = Config.WHATSAPP_QUEUE_PUT_TIMEOUT
+        try:
+            self._shard(inbound["wa_id"]).put(inbound, timeout=timeout)
+            return True
+        except queue.Full:
+            print(f"WARNING: Webhook queue full for {inbound['wa_id']}", flush=True)
+            return False
+
+    def pending(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _run(self, q):
+        while True:
+            # Drain whatever has accumulated so sessions load and save in bulk
+            batch = [q.get()]
+            while len(batch) < Config.WHATSAPP_WORKER_BATCH_SIZE:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    deferred = process_messages(batch)
+                # Sessions leased elsewhere: retry behind what is queued now
+                for inbound in deferred:
+                    if not self.submit(inbound, timeout=0):
+                        print(f"WARNING: Dropping message {inbound.get('id')} from {inbound['wa_id']}", flush=True)
+            except Exception as e:
+                print(f"Error processing queued WhatsApp messages: {e}", flush=True)
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+webhook_pool = WebhookWorkerPool()
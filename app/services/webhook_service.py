@@ -0,0 +1,189 @@
+import copy
+import json
+from app.services.whatsapp_service import build_reply_payload, dispatch_payload
+from app.services.conversation_flow import handle_conversational_flow
+from app.services.session_service import lease_user_sessions, save_leased_sessions
+from app.services.dedup_service import filter_new_messages, release_message_ids
+
+# Sent instead of the state machine's reply when handling a message fails.
+# Its message id stays claimed: the handler may already have had side
+# effects, so a redelivery must not run it again.
+ERROR_REPLY = "⚠️ Sorry, something went wrong with your last message. Please try again, or type 'START' to begin again."
+
+def extract_messages(payload):
+    """
+    Flattens a WhatsApp webhook payload into normalized inbound messages.
+    Each message is a plain dict so it can be queued and processed later.
+    """
+    extracted = []
+    for entry in payload.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            for message in value.get('messages', []):
+                inbound = _normalize_message(message)
+                if inbound:
+                    extracted.append(inbound)
+    return extracted
+
+def _normalize_message(message):
+    """
+    Converts a raw WhatsApp message (text, buttons, lists, flows, images)
+    into {"id", "wa_id", "text", "is_button", "flow_response"}.
+    """
+    user_text = ""
+    is_button = False
+    flow_response = None
+
+    # Handle Text Messages
+    if message.get('type') == 'text':
+        user_text = message.get('text', {}).get('body')
+
+    # Handle Button Replies
+    elif message.get('type') == 'interactive':
+        interactive = message.get('interactive', {})
+        if interactive.get('type') == 'button_reply':
+            user_text = interactive.get('button_reply', {}).get('id')
+            is_button = True
+        # Handle List Replies
+        elif interactive.get('type') == 'list_reply':
+            user_text = interactive.get('list_reply', {}).get('id')
+            is_button = True # Treat list selection as a button/id interaction
+        # Handle WhatsApp Flow Replies
+        elif interactive.get('type') == 'nfm_reply':
+            nfm_reply = interactive.get('nfm_reply', {})
+            flow_response = json.loads(nfm_reply.get('response_json', '{}'))
+            user_text = f"FLOW_SUBMIT_{nfm_reply.get('name', 'unknown')}"
+            is_button = True
+
+    # Handle Image Messages
+    elif message.get('type') == 'image':
+        image_id = message.get('image', {}).get('id')
+        user_text = f"MEDIA_IMAGE_{image_id}"
+        is_button = True # Treat media as a special automated interaction
+
+    if not user_text:
+        return None
+
+    return {
+        "id": message.get('id'),
+        "wa_id": message.get('from'),
+        "text": user_text,
+        "is_button": is_button,
+        "flow_response": flow_response
+    }
+
+def process_messages(batch, lease_wait=None):
+    """
+    Runs a batch of normalized messages through the state machine in order.
+    Sessions for every sender are loaded with one query and written back
+    with one bulk_write, then the replies are sent in arrival order.
+    Redelivered messages are dropped before touching any session state.
+    A message whose handler fails gets ERROR_REPLY and is not retried.
+
+    Senders whose session is leased elsewhere for longer than `lease_wait`
+    seconds are not processed; their messages are returned, unclaimed, for
+    the caller to retry.
+    """
+    batch = filter_new_messages(batch)
+    if not batch:
+        return []
+
+    by_sender = {}
+    for position, inbound in enumerate(batch):
+        by_sender.setdefault(inbound["wa_id"], []).append((position, inbound))
+
+    replies, deferred = _process_senders(by_sender, lease_wait)
+
+    # 4. Send responses
+    ordered = sorted((reply for sender_replies in replies.values() for reply in sender_replies), key=lambda reply: reply[0])
+    for _, *reply in ordered:
+        send_reply(*reply)
+    return deferred
+
+def _process_senders(by_sender, lease_wait=None):
+    """
+    Runs each sender's messages and saves their sessions.
+    Returns the replies to send, keyed by sender, and the messages of
+    senders that could not be leased.
+    """
+    # 1. Lease all sessions for the batch (Only once). Handlers have side
+    # effects, so a sender is never processed by two workers at once and a
+    # flow is never re-run.
+    try:
+        lease_id, sessions = lease_user_sessions(list(by_sender), wait=lease_wait)
+    except Exception:
+        # Nothing has run yet; let the redelivery of these messages through
+        release_message_ids([inbound.get("id") for messages in by_sender.values() for _, inbound in messages])
+        raise
+    updates = {}
+    replies = {}
+    deferred = []
+
+    try:
+        # 2. Process conversation flow; _run_flow contains each failure
+        for sender_id, messages in by_sender.items():
+            if sender_id not in sessions:
+                # Never started, so they may run again when retried
+                release_message_ids([inbound.get("id") for _, inbound in messages])
+                deferred += [inbound for _, inbound in messages]
+                continue
+            updates[sender_id], replies[sender_id] = _run_flow(sender_id, messages, sessions[sender_id])
+    finally:
+        # 3. Update all sessions in DB and release the leases
+        try:
+            lost = save_leased_sessions(lease_id, updates, release=[s for s in sessions if s not in updates])
+        except Exception as e:
+            # The handlers already ran; still tell the users what happened
+            print(f"Error saving sessions for {list(updates)}: {e}", flush=True)
+            lost = []
+    for sender_id in lost:
+        print(f"WARNING: Lease for {sender_id} expired mid-flow; session update dropped", flush=True)
+    return replies, deferred
+
+def _run_flow(sender_id, messages, session_record):
+    """
+    Applies one sender's messages to their session in memory.
+    Returns the session update to persist and the replies to send. If a
+    message fails, the session keeps the state from before it, the sender
+    gets ERROR_REPLY, and their remaining messages in the batch are skipped.
+    """
+    replies = []
+
+    for position, inbound in messages:
+        # Attach Flow Data captured from the nfm_reply
+        session_record.pop('flow_response', None)
+        if inbound.get("flow_response"):
+            session_record['flow_response'] = inbound["flow_response"]
+
+        print(f"DEBUG: Processing {sender_id} | State: {session_record.get('state')} | Text: {inbound['text']}", flush=True)
+
+        # Handlers edit session data in place; keep a copy to roll back to
+        state, data = session_record.get("state"), copy.deepcopy(session_record.get("data"))
+        try:
+            response_text, next_state, updated_data, buttons, list_data = handle_conversational_flow(
+                sender_id, inbound["text"], session_record, is_button=inbound["is_button"]
+            )
+        except Exception as e:
+            print(f"Error processing message {inbound.get('id')} from {sender_id}: {e}", flush=True)
+            session_record["state"], session_record["data"] = state, data
+            replies.append((position, sender_id, ERROR_REPLY, None, None))
+            break
+
+        print(f"DEBUG: Next State: {next_state}", flush=True)
+
+        # Later messages from the same sender see the updated state
+        if next_state:
+            session_record["state"] = next_state
+        if updated_data is not None:
+            session_record["data"] = updated_data
+        replies.append((position, sender_id, response_text, buttons, list_data))
+
+    update = {"state": session_record.get("state"), "data": session_record.get("data")}
+    return update, replies
+
+def send_reply(recipient_id, response_text, buttons=None, list_data=None):
+    """
+    Sends a state machine reply as a List, Button, Flow or Text message.
+    """
+    payload, kind = build_reply_payload(recipient_id, response_text, buttons, list_data)
+    return dispatch_payload(payload, kind)
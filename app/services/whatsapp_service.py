@@ -1,16 +1,13 @@
-import google.generativeai as genai
-import requests
 import json
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from app.config import Config
-from app.database import get_db
-
-# Configure Gemini
-genai.configure(api_key=Config.GEMINI_API_KEY)
-
-# Risk Classification Model and Prompt
-risk_model = genai.GenerativeModel('gemini-2.5-flash')
+from app.services.graph_client import get_graph_client
+from app.services.outbound_dispatcher import outbound_dispatcher
+from app.services.llm_client import get_llm_client, LLMUnavailable
+from app.services.risk_classifier import fast_classify
+from app.services.response_cache import get_cached_response, set_cached_response, prompt_fingerprint
 
+# Risk Classification Prompt
 RISK_CLASSIFICATION_SYSTEM_PROMPT = """You are an emotional risk classification system for a student mental health support platform.
 
 Your task is to analyze the user's message and classify their psychological risk level into ONLY ONE of the following categories:
@@ -129,562 +126,153 @@ You must:
 • Respond naturally as if you do not know this label explicitly.
 Your goal is to create a safe, confidential, and student-friendly space that supports early stress awareness and emotional balance. {risk_level}"""
 
+# Combined mode: one structured call returns both the risk level and the
+# reply. It reuses the classification rules and the Mindly guidelines from
+# the prompts above (minus their single-call output instructions).
+RISK_LEVELS = ["LOW", "MODERATE", "HIGH", "CRITICAL"]
+
+COMBINED_SYSTEM_PROMPT = (
+    MINDLY_SYSTEM_PROMPT.split("SYSTEM INTERNAL CONTEXT")[0]
+    + "INTERNAL RISK ASSESSMENT (Not visible to user):\n\n"
+    + RISK_CLASSIFICATION_SYSTEM_PROMPT.split("IMPORTANT RULES:")[0]
+    + """Before replying, classify the user's message using the rules above.
+Consider tone, intent, and context — not just keywords. Even indirect suicidal
+hints must be classified as CRITICAL. If unsure between HIGH and CRITICAL, choose CRITICAL.
+Use the level only to adjust empathy and urgency; never mention it in the reply.
+
+Respond with a JSON object only:
+{"risk_level": "LOW" | "MODERATE" | "HIGH" | "CRITICAL", "reply": "<your message to the student>"}"""
+)
+
+SUPPORT_PROMPT_VERSION = prompt_fingerprint(MINDLY_SYSTEM_PROMPT + COMBINED_SYSTEM_PROMPT)
+
+MINDLY_FALLBACK_RESPONSE = "I'm here for you and I want to help. Would you like to tell me more about what's on your mind?"
+
+_ai_pool = ThreadPoolExecutor(max_workers=Config.AI_PARALLEL_WORKERS, thread_name_prefix="mindly-ai")
+
 def classify_risk(user_message):
     """
     Classifies the user's emotional risk level.
+    Clear cases are resolved locally; ambiguous ones go to Gemini, and the
+    local guess is used if Gemini cannot be reached.
     """
+    local_level, confident = fast_classify(user_message)
+    if confident:
+        return local_level
+
     try:
-        chat = risk_model.start_chat()
-        response = chat.send_message(f"{RISK_CLASSIFICATION_SYSTEM_PROMPT}\n\nUser message: {user_message}")
-        risk_level = response.text.strip().upper()
-        # Ensure it's one of the valid categories
-        if risk_level not in ["LOW", "MODERATE", "HIGH", "CRITICAL"]:
-            # Fallback logic if Gemini persists with extra text
-            for level in ["CRITICAL", "HIGH", "MODERATE", "LOW"]:
-                if level in risk_level:
-                    return level
-            return "LOW"
-        return risk_level
-    except Exception as e:
+        return classify_risk_with_gemini(user_message)
+    except LLMUnavailable as e:
         print(f"Error in risk classification: {e}")
+        return local_level
+
+def classify_risk_with_gemini(user_message):
+    """
+    Asks Gemini for the risk level, skipping the local fast path.
+    Raises LLMUnavailable instead of falling back to a guess.
+    """
+    response_text = get_llm_client().generate(
+        f"{RISK_CLASSIFICATION_SYSTEM_PROMPT}\n\nUser message: {user_message}",
+        label="classify_risk",
+        timeout=Config.LLM_RISK_TIMEOUT_SECONDS
+    )
+    risk_level = response_text.strip().upper()
+    # Ensure it's one of the valid categories
+    if risk_level not in ["LOW", "MODERATE", "HIGH", "CRITICAL"]:
+        # Fallback logic if Gemini persists with extra text
+        for level in ["CRITICAL", "HIGH", "MODERATE", "LOW"]:
+            if level in risk_level:
+                return level
         return "LOW"
+    return risk_level
+
+def _with_history(history):
+    return f"\n\nConversation so far:\n{history}" if history else ""
 
-def generate_mindly_response(user_message, risk_level):
+def generate_mindly_response(user_message, risk_level, history=""):
     """
-    Generates a Mindly response based on user message and risk level.
+    Generates a Mindly response based on user message and risk level,
+    optionally continuing a conversation (see conversation_memory).
     """
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
         prompt = MINDLY_SYSTEM_PROMPT.format(risk_level=risk_level)
-        response = model.generate_content(f"{prompt}\n\nUser message: {user_message}")
-        return response.text
-    except Exception as e:
+        return get_llm_client().generate(f"{prompt}{_with_history(history)}\n\nUser message: {user_message}", label="mindly_response")
+    except LLMUnavailable as e:
         print(f"Error in Mindly response generation: {e}")
-        return "I'm here for you and I want to help. Would you like to tell me more about what's on your mind?"
+        return MINDLY_FALLBACK_RESPONSE
 
-def handle_conversational_flow(wa_id, message_text, session, is_button=False):
+def classify_and_respond(user_message, history=""):
     """
-    Main state machine for Mindly WhatsApp conversations.
+    Returns (risk_level, reply) for an emotional support message.
+    Uses a single structured Gemini call when MINDLY_COMBINED_AI is on;
+    otherwise, or if that call fails, classification and generation run in
+    parallel instead of back to back.
+    Replies to opening messages the local classifier resolves confidently
+    (never crises) are served from and stored in the response cache.
     """
-    state = session.get("state", "START")
-    data = session.get("data", {})
-    text = message_text.strip()
-    
-    print(f"DEBUG: wa_id={wa_id}, state={state}, text={text}", flush=True)
-    
-    db = get_db()
-    
-    # Global Reset Command
-    if text.upper() in ["RESET", "START", "HI", "HELLO", "TEST REGISTRATION"]:
-        # Special debug command to test the NEW registration flow
-        if text.upper() == "TEST REGISTRATION":
-            db.users.delete_one({"wa_id": wa_id})
-            db.chat_sessions.delete_one({"wa_id": wa_id})
-            return "🗑️ *Test Mode:* Your old profile has been cleared.\nType 'HI' to start the new registration!", "START", {}, None, None
-
-        # 1. Check if user already exists in DB
-        user = db.users.find_one({"wa_id": wa_id})
-        if user:
-            role = user.get("role", "student").capitalize()
-            if role == "Doctor":
-                pending_count = db.counseling_sessions.count_documents({"status": "Pending"})
-                response = (f"Welcome back, Dr. {user['name']}! 🩺\n\n"
-                            f"Your dashboard:\n"
-                            f"• Pending Sessions: {pending_count}\n"
-                            f"• Status: Active")
-                
-                buttons = [{"id": "DR_VIEW_REQS", "title": "View Requests"}]
-                return response, "DOCTOR_DASHBOARD", {"role": "Doctor", "name": user["name"]}, buttons, None
-            else:
-                response = f"Welcome back to Mindly, {user['name']}! 🎓\nHow can I support you today?"
-                buttons = [
-                    {"id": "STUDENT_SUPPORT", "title": "Support Chat"},
-                    {"id": "STUDENT_BOOK", "title": "Book Session"},
-                    {"id": "STUDENT_MY_SESSIONS", "title": "My Sessions"}
-                ]
-                return response, "STUDENT_MENU", {"role": "Student", "name": user["name"]}, buttons, None
-        
-        # New User Flow
-        state = "START"
-        data = {}
-
-    # Global Role Selection (Independent of state to prevent loops)
-    if text == "ROLE_STUDENT":
-        return ("Welcome! Please complete the registration form:"), "ROLE_SELECTION", {"role": "Student"}, None, {
-            "type": "flow",
-            "flow_id": Config.WHATSAPP_FLOW_ID,
-            "flow_token": f"student_{wa_id}",
-            "button": "Fill Form 🎓"
-        }
-    elif text == "ROLE_DOCTOR":
-        return ("Mindly - Doctor Onboarding 🩺\n\nPlease complete the verification carefully:"), "ROLE_SELECTION", {"role": "Doctor"}, None, {
-            "type": "flow",
-            "flow_id": Config.WHATSAPP_FLOW_ID,
-            "flow_token": f"doctor_{wa_id}",
-            "button": "Start Onboarding 🩺"
-        }
-
-    if state == "START":
-        # Silent redirect for existing users who are in START state
-        user = db.users.find_one({"wa_id": wa_id})
-        if user:
-            role = user.get("role", "student").capitalize()
-            # If Doctor/Student exists, use logic to re-trigger current state
-            return handle_conversational_flow(wa_id, "START", session, is_button=True)
-
-        # Flow Submission Handler (Native Form Data)
-        if text.startswith("FLOW_SUBMIT_"):
-            flow_data = session.get("flow_response", {})
-            if not flow_data:
-                return "❌ Error: Flow data lost. Please try the text registration below.", "START", {}, None, None
-            
-            # Map Flow fields to Database fields
-            data.update({
-                "name": flow_data.get("full_name"),
-                "email": flow_data.get("email"),
-                "phone": flow_data.get("phone")
-            })
-            
-            if "license_no" in flow_data: # Doctor Flow
-                data["license_no"] = flow_data["license_no"]
-                data["available_from_date"] = flow_data.get("from_date")
-                data["available_to_date"] = flow_data.get("to_date")
-                
-                # Extract Times
-                start_time = flow_data.get("start_time", "09:00")
-                end_time = flow_data.get("end_time", "17:00")
-                data["available_times"] = [f"{start_time} - {end_time}"]
-                
-                # Extract Media Tokens from multi-photo picker
-                id_proofs = flow_data.get("id_proofs", [])
-                if len(id_proofs) >= 2:
-                    data["medical_id_img"] = id_proofs[0]
-                    data["govt_id_img"] = id_proofs[1]
-                elif len(id_proofs) == 1:
-                    data["medical_id_img"] = id_proofs[0]
-
-                # Finalize Dr Registration directly from Flow if IDs are provided
-                if data.get("medical_id_img") and data.get("govt_id_img"):
-                    db.users.update_one({"wa_id": wa_id}, {"$set": {
-                        "name": data["name"],
-                        "email": data["email"],
-                        "phone": data["phone"],
-                        "license_no": data["license_no"],
-                        "available_from_date": data.get("available_from_date"),
-                        "available_to_date": data.get("available_to_date"),
-                        "available_times": data["available_times"],
-                        "medical_id": data["medical_id_img"],
-                        "govt_id": data["govt_id_img"],
-                        "role": "Doctor",
-                        "status": "Active",
-                        "registered_at": datetime.utcnow()
-                    }}, upsert=True)
-                    
-                    return (f"🎊 *Registration Complete!*\n\n"
-                            f"Welcome, Dr. {data['name']}! 🩺\n"
-                            "Your professional credentials and availability have been stored.\n\n"
-                            "Your dashboard:"), "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View Requests"}], None
-
-                return ("🎊 *Registration & Availability Received!*\n\n"
-                        f"Welcome, Dr. {data['name']}! 🩺\n"
-                        "To finish, please send a photo of your *Medical ID Card*:"), "DR_REG_MEDICAL_ID", data, None, None
-            else: # Student Flow
-                db.users.update_one({"wa_id": wa_id}, {"$set": {
-                    "name": data["name"],
-                    "email": data["email"],
-                    "phone": data["phone"],
-                    "role": "Student",
-                    "registered_at": datetime.utcnow()
-                }}, upsert=True)
-                return (f"🎊 *Registration Complete!*\n\n"
-                        f"Welcome, {data['name']}! 🎓\n"
-                        "How can I support you today?"), "STUDENT_MENU", data, [
-                    {"id": "STUDENT_SUPPORT", "title": "Support Chat"},
-                    {"id": "STUDENT_BOOK", "title": "Book Session"},
-                    {"id": "STUDENT_MY_SESSIONS", "title": "My Sessions"}
-                ], None
-
-        response = "Welcome to Mindly 💙\nYour mental health companion. Please select your role to get started:"
-        buttons = [
-            {"id": "ROLE_STUDENT", "title": "I'm a Student"},
-            {"id": "ROLE_DOCTOR", "title": "I'm a Doctor"},
-            {"id": "ROLE_OTHER", "title": "Other"}
-        ]
-        return response, "ROLE_SELECTION", {}, buttons, None
-
-    # --- DOCTOR DASHBOARD & 2-STEP MGMT ---
-    elif state == "DOCTOR_DASHBOARD":
-        if text.upper() in ["DR_VIEW_REQS", "VIEW REQUESTS"]:
-            pending_list = list(db.counseling_sessions.find({"status": "Pending"}).limit(10))
-            if not pending_list:
-                return "*No pending requests at the moment.*", "DOCTOR_DASHBOARD", data, None, None
-            
-            rows = []
-            for i, sess in enumerate(pending_list):
-                student = db.users.find_one({"wa_id": sess["student_wa_id"]})
-                name = student.get("name", "Unknown") if student else "Unknown"
-                display_name = (name[:20] + '..') if len(name) > 20 else name
-                rows.append({
-                    "id": f"DR_SEL_REQ_{sess['_id']}",
-                    "title": f"{i+1}. {display_name}",
-                    "description": f"{sess['date']} @ {sess['time']}"
-                })
-            
-            # Action Rows for Step 1
-            action_rows = [
-                {"id": "DR_BULK_APPROVE_ALL", "title": "Approve All ✅", "description": "Approve all current requests"},
-                {"id": "DR_BULK_DECLINE_ALL", "title": "Decline All ❌", "description": "Decline all current requests"},
-                {"id": "DR_MODE_MULTI_SELECT", "title": "Select Multiple 📋", "description": "Pick specific students to approve"}
-            ]
-            
-            list_data = {
-                "button": "View/Manage",
-                "sections": [
-                    {"title": "Student List", "rows": rows},
-                    {"title": "Bulk Actions", "rows": action_rows}
-                ]
-            }
-            return "*Manage Requests*\nSelect a student to view details, or choose a bulk action below:", "DOCTOR_LIST_REQS", data, None, list_data
-        
-        elif text == "DR_DASHBOARD":
-            return "*Refreshing dashboard...*", "START", data, None, None
-
-    elif state == "DOCTOR_LIST_REQS":
-        # Handle Single Selection Mode
-        if text.startswith("DR_SEL_REQ_"):
-            from bson import ObjectId
-            session_id = text.replace("DR_SEL_REQ_", "")
-            sess = db.counseling_sessions.find_one({"_id": ObjectId(session_id)})
-            if sess:
-                student = db.users.find_one({"wa_id": sess["student_wa_id"]})
-                name = student.get("name", "Unknown") if student else "Unknown"
-                response = (f"*Managing Request for:* {name}\n\n"
-                            f"*Date:* {sess['date']}\n"
-                            f"*Time:* {sess['time']}\n"
-                            f"*Concern:* {sess['description']}\n\n"
-                            "What would you like to do?")
-                buttons = [
-                    {"id": f"DR_APPROVE_{session_id}", "title": "Approve"},
-                    {"id": f"DR_DECLINE_{session_id}", "title": "Decline"},
-                    {"id": "DR_VIEW_REQS", "title": "Back to List"}
-                ]
-                return response, "DOCTOR_MANAGE_REQ", data, buttons, None
-
-        # Bulk All Actions
-        elif text == "DR_BULK_APPROVE_ALL":
-            pending_list = list(db.counseling_sessions.find({"status": "Pending"}))
-            for sess in pending_list:
-                db.counseling_sessions.update_one({"_id": sess["_id"]}, {"$set": {"status": "Approved", "approved_by": wa_id}})
-                send_whatsapp_message(sess["student_wa_id"], f"*Approved:* Your session for {sess['date']} @ {sess['time']} is confirmed! 🩺")
-            return f"*Bulk Success:* {len(pending_list)} students approved!", "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View More"}], None
-
-        elif text == "DR_BULK_DECLINE_ALL":
-            res = db.counseling_sessions.update_many({"status": "Pending"}, {"$set": {"status": "Declined", "declined_by": wa_id}})
-            return f"*Bulk Success:* {res.modified_count} students declined.", "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View More"}], None
-
-        # --- STEP 2: MULTI-SELECT MODE (Checkbox Style) ---
-        elif text == "DR_MODE_MULTI_SELECT" or text.startswith("DR_TOGGLE_"):
-            if text.startswith("DR_TOGGLE_"):
-                session_id = text.replace("DR_TOGGLE_", "")
-                selected_ids = data.get("selected_ids", [])
-                if session_id in selected_ids: selected_ids.remove(session_id)
-                else: selected_ids.append(session_id)
-                data["selected_ids"] = selected_ids
-
-            pending_list = list(db.counseling_sessions.find({"status": "Pending"}).limit(10))
-            selected_ids = data.get("selected_ids", [])
-            rows = []
-            for i, sess in enumerate(pending_list):
-                student = db.users.find_one({"wa_id": sess["student_wa_id"]})
-                name = student.get("name", "Unknown") if student else "Unknown"
-                status_box = "☑️" if str(sess["_id"]) in selected_ids else "⬜"
-                rows.append({"id": f"DR_TOGGLE_{sess['_id']}", "title": f"{status_box} {name}", "description": f"{sess['date']} @ {sess['time']}"})
-            
-            actions = []
-            if selected_ids:
-                actions.append({"id": "DR_BULK_SEL_APPROVE", "title": f"Approve Selected ({len(selected_ids)}) ✅", "description": "Approve all checked items"})
-            actions.append({"id": "DR_VIEW_REQS", "title": "Back to Main Menu ⬅️", "description": "Exit Multi-Select"})
-
-            list_data = {"button": "Select Students", "sections": [{"title": "Toggle selection", "rows": rows}, {"title": "Action", "rows": actions}]}
-            
-            prompt = ("*Select Multiple Mode*\n"
-                      "Due to WhatsApp limits, you can pick one student at a time in the menu below. "
-                      "It will re-open with your update.\n\n"
-                      "🚀 *Turbo Tip:* Just *type* the numbers (e.g. `1,2,4`) to select many students at once!")
-            
-            return prompt, "DOCTOR_LIST_REQS", data, None, list_data
-
-        # Handle Numeric Selection (Turbo Mode)
-        elif any(char.isdigit() for char in (text if len(text) < 10 else "")): # Basic check for numbers in short messages
-            pending_list = list(db.counseling_sessions.find({"status": "Pending"}).limit(10))
-            selected_ids = data.get("selected_ids", [])
-            import re
-            numbers = re.findall(r'\d+', text)
-            
-            toggled_count = 0
-            for num_str in numbers:
-                try:
-                    idx = int(num_str) - 1
-                    if 0 <= idx < len(pending_list):
-                        sid = str(pending_list[idx]["_id"])
-                        if sid in selected_ids: selected_ids.remove(sid)
-                        else: selected_ids.append(sid)
-                        toggled_count += 1
-                except: continue
-            
-            data["selected_ids"] = selected_ids
-            # Re-trigger the same state handler to show the updated menu
-            # Pass the full session object (state + data) for the recursive call
-            return handle_conversational_flow(wa_id, "DR_MODE_MULTI_SELECT", {"state": "DOCTOR_LIST_REQS", "data": data}, is_button=True)
-
-        # Final Approval for Selective Multi
-        elif text == "DR_BULK_SEL_APPROVE":
-            selected_ids = data.get("selected_ids", [])
-            from bson import ObjectId
-            for sid in selected_ids:
-                sess = db.counseling_sessions.find_one({"_id": ObjectId(sid)})
-                if sess:
-                    db.counseling_sessions.update_one({"_id": ObjectId(sid)}, {"$set": {"status": "Approved", "approved_by": wa_id}})
-                    send_whatsapp_message(sess["student_wa_id"], f"*Approved:* Your session for {sess['date']} @ {sess['time']} is confirmed! 🩺")
-            data["selected_ids"] = []
-            return f"*Success:* {len(selected_ids)} students approved & notified!", "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View More"}], None
-
-    elif state == "DOCTOR_MANAGE_REQ":
-        # Handle single approval/decline (kept stable)
-        if text.startswith("DR_APPROVE_"):
-            from bson import ObjectId
-            session_id = text.replace("DR_APPROVE_", "")
-            sess = db.counseling_sessions.find_one({"_id": ObjectId(session_id)})
-            if sess:
-                db.counseling_sessions.update_one({"_id": ObjectId(session_id)}, {"$set": {"status": "Approved", "approved_by": wa_id}})
-                send_whatsapp_message(sess["student_wa_id"], f"*Approved:* Your session for {sess['date']} @ {sess['time']} is confirmed! 🩺")
-                return "*Session approved!*", "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View More"}], None
-        elif text.startswith("DR_DECLINE_"):
-            from bson import ObjectId
-            session_id = text.replace("DR_DECLINE_", "")
-            db.counseling_sessions.update_one({"_id": ObjectId(session_id)}, {"$set": {"status": "Declined", "declined_by": wa_id}})
-            return "*Session declined.*", "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View More"}], None
-        elif text == "DR_VIEW_REQS":
-            return "*Returning to list...*", "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "Click to Reload"}], None
-
-    # --- STUDENT FLOW & SESSION MGMT ---
-    elif state == "STUDENT_MENU":
-        if text == "STUDENT_SUPPORT":
-            return ("*Emotional Support Mode* 💙\n"
-                    "Tell me what's on your mind. (Type 'MENU' anytime to exit)"), "EMOTIONAL_SUPPORT", data, None, None
-        elif text == "STUDENT_BOOK":
-            from datetime import datetime, timedelta
-            today = datetime.now()
-            rows = []
-            for i in range(7):
-                date = today + timedelta(days=i)
-                date_str = date.strftime("%Y-%m-%d")
-                rows.append({
-                    "id": f"BOOK_DATE_{date_str}",
-                    "title": date.strftime("%A, %b %d"),
-                    "description": "Select this day"
-                })
-            
-            list_data = {
-                "button": "Choose Date",
-                "sections": [{"title": "Select a Day", "rows": rows}]
-            }
-            return "*Session Booking* 🗓️\nPlease select a date for your session:", "BOOKING_DATE", data, None, list_data
-        elif text == "STUDENT_MY_SESSIONS":
-            my_sessions = list(db.counseling_sessions.find({
-                "student_wa_id": wa_id,
-                "status": {"$in": ["Pending", "Approved"]}
-            }).limit(10))
-            
-            if not my_sessions:
-                return "*No active sessions found.*", "STUDENT_MENU", data, [{"id": "STUDENT_BOOK", "title": "Book One Now"}], None
-            
-            rows = []
-            for i, sess in enumerate(my_sessions):
-                rows.append({
-                    "id": f"STUDENT_SEL_SESS_{sess['_id']}",
-                    "title": f"{sess['date']} @ {sess['time']}",
-                    "description": f"Status: {sess['status']}"
-                })
-            
-            list_data = {
-                "button": "View Session",
-                "sections": [{"title": "Your Sessions", "rows": rows}]
-            }
-            return "*Your Sessions:*\nSelect one below to view details or cancel:", "STUDENT_MY_SESSIONS", data, None, list_data
-
-    elif state == "STUDENT_MY_SESSIONS":
-        if text.startswith("STUDENT_SEL_SESS_"):
-            from bson import ObjectId
-            session_id = text.replace("STUDENT_SEL_SESS_", "")
-            sess = db.counseling_sessions.find_one({"_id": ObjectId(session_id)})
-            if sess:
-                response = (f"*Session Details*\n\n"
-                            f"• *Date:* {sess['date']}\n"
-                            f"• *Time:* {sess['time']}\n"
-                            f"• *Status:* {sess['status']}\n"
-                            f"• *Concern:* {sess['description']}\n\n"
-                            "What would you like to do?")
-                buttons = [
-                    {"id": f"STUDENT_CANCEL_{session_id}", "title": "Cancel Session"},
-                    {"id": "STUDENT_MY_SESSIONS", "title": "Back to List"}
-                ]
-                return response, "STUDENT_MANAGE_SESS", data, buttons, None
-        return "*Back to Student Menu.*", "START", data, None, None
-
-    elif state == "STUDENT_MANAGE_SESS":
-        if text.startswith("STUDENT_CANCEL_"):
-            from bson import ObjectId
-            session_id = text.replace("STUDENT_CANCEL_", "")
-            db.counseling_sessions.update_one(
-                {"_id": ObjectId(session_id)},
-                {"$set": {"status": "Cancelled", "cancelled_by": "student"}}
+    local_level, confident = fast_classify(user_message)
+    cacheable = confident and local_level != "CRITICAL" and not history
+    if cacheable:
+        cached = get_cached_response(SUPPORT_PROMPT_VERSION, user_message, local_level)
+        if cached:
+            return local_level, cached
+
+    risk_level, reply = _classify_and_respond(user_message, local_level, confident, history)
+    if cacheable and risk_level == local_level and reply != MINDLY_FALLBACK_RESPONSE:
+        set_cached_response(SUPPORT_PROMPT_VERSION, user_message, local_level, reply)
+    return risk_level, reply
+
+def _classify_and_respond(user_message, local_level, confident, history):
+    if Config.MINDLY_COMBINED_AI:
+        try:
+            response_text = get_llm_client().generate(
+                f"{COMBINED_SYSTEM_PROMPT}{_with_history(history)}\n\nUser message: {user_message}",
+                label="classify_and_respond",
+                generation_config={"response_mime_type": "application/json"}
             )
-            return "*Session successfully cancelled.*", "START", data, None, None
-        elif text == "STUDENT_MY_SESSIONS":
-            return "*Loading sessions...*", "STUDENT_MENU", {"button_click": "STUDENT_MY_SESSIONS"}, [{"id": "STUDENT_MY_SESSIONS", "title": "View Again"}], None
-
-    elif state == "STUDENT_REG_NAME":
-        data["name"] = text
-        return f"Welcome, {text}! 🎓\n\nWhat is your *Email Address*?", "STUDENT_REG_EMAIL", data, None, None
-
-    elif state == "STUDENT_REG_EMAIL":
-        import re
-        if not re.match(r"[^@]+@[^@]+\.[^@]+", text):
-            return "❌ Invalid email format. Please try again:", "STUDENT_REG_EMAIL", data, None, None
-        data["email"] = text
-        return "Got it. What is your *Phone Number*? (with country code):", "STUDENT_REG_PHONE", data, None, None
-
-    elif state == "STUDENT_REG_PHONE":
-        data["phone"] = text
-        db.users.update_one({"wa_id": wa_id}, {"$set": {
-            "name": data["name"],
-            "email": data["email"],
-            "phone": data["phone"],
-            "role": "Student",
-            "registered_at": datetime.utcnow()
-        }}, upsert=True)
-        
-        return f"Nice to meet you, {data['name']}! 🎓\nHow can I support you today?", "STUDENT_MENU", data, [
-            {"id": "STUDENT_SUPPORT", "title": "Support Chat"},
-            {"id": "STUDENT_BOOK", "title": "Book Session"},
-            {"id": "STUDENT_MY_SESSIONS", "title": "My Sessions"}
-        ], None
-
-    elif state == "BOOKING_DATE":
-        if text.startswith("BOOK_DATE_"):
-            data["booking_date"] = text.replace("BOOK_DATE_", "")
-            
-            time_slots = [
-                {"id": "TIME_0900", "title": "09:00 AM", "description": "Morning"},
-                {"id": "TIME_1100", "title": "11:00 AM", "description": "Morning"},
-                {"id": "TIME_1400", "title": "02:00 PM", "description": "Afternoon"},
-                {"id": "TIME_1600", "title": "04:00 PM", "description": "Afternoon"},
-                {"id": "TIME_1900", "title": "07:00 PM", "description": "Evening"}
-            ]
-            list_data = {
-                "button": "Choose Time",
-                "sections": [{"title": "Available Slots", "rows": time_slots}]
-            }
-            return "Great! 🗓️ Now, pick a *time* that works for you:", "BOOKING_TIME", data, None, list_data
-        return "❌ Please select a date from the menu.", "BOOKING_DATE", data, None, None
-
-    elif state == "BOOKING_TIME":
-        if text.startswith("TIME_"):
-            data["booking_time"] = text.replace("TIME_", "")[:2] + ":" + text.replace("TIME_", "")[2:]
-            return "Understood. 🧠 Briefly describe your *concern* or what you'd like to talk about:", "BOOKING_DESC", data, None, None
-        return "❌ Please select a time slot from the menu.", "BOOKING_TIME", data, None, None
-
-    elif state == "BOOKING_DESC":
-        new_session = {
-            "student_wa_id": wa_id,
-            "date": data["booking_date"],
-            "time": data["booking_time"],
-            "description": text,
-            "status": "Pending",
-            "created_at": datetime.utcnow()
-        }
-        db.counseling_sessions.insert_one(new_session)
-        # Notify Doctors (Optional but good)
-        return ("✅ *Booking Request Sent!* 🚀\n\nA doctor will review your request soon. You'll be notified once it's approved."), "STUDENT_MENU", data, [
-            {"id": "STUDENT_SUPPORT", "title": "Support Chat"},
-            {"id": "STUDENT_BOOK", "title": "Book Another"},
-            {"id": "STUDENT_MY_SESSIONS", "title": "My Sessions"}
-        ], None
-
-    elif state == "DR_REG_NAME":
-        data["name"] = text
-        return f"Nice to meet you, Dr. {text}! 🩺\n\nWhat is your *Email Address*?", "DR_REG_EMAIL", data, None, None
-
-    elif state == "DR_REG_EMAIL":
-        import re
-        if not re.match(r"[^@]+@[^@]+\.[^@]+", text):
-            return "❌ Invalid email format. Please try again (e.g. name@example.com):", "DR_REG_EMAIL", data, None, None
-        data["email"] = text
-        return "Got it. Now, what is your *Phone Number*? (with country code):", "DR_REG_PHONE", data, None, None
-
-    elif state == "DR_REG_PHONE":
-        data["phone"] = text
-        return "Thank you. Finally, what is your *Medical License Number*?", "DR_REG_LICENSE", data, None, None
-
-    elif state == "DR_REG_LICENSE":
-        data["license_no"] = text
-        # Transition to Media Upload
-        return ("📄 *Identity Verification*\n\n"
-                "To verify your professional status, please send a photo of your *Medical ID Card* now:"), "DR_REG_MEDICAL_ID", data, None, None
-
-    elif state == "DR_REG_MEDICAL_ID":
-        if text.startswith("MEDIA_IMAGE_"):
-            data["medical_id_img"] = text.replace("MEDIA_IMAGE_", "")
-            return "✅ Received! Finally, please send a photo of any *Government ID* (e.g. Aadhaar, License):", "DR_REG_GOVT_ID", data, None, None
-        return "❌ Please send an *image* of your Medical ID Card.", "DR_REG_MEDICAL_ID", data, None, None
-
-    elif state == "DR_REG_GOVT_ID":
-        if text.startswith("MEDIA_IMAGE_"):
-            data["govt_id_img"] = text.replace("MEDIA_IMAGE_", "")
-            
-            # Finalize Registration
-            db.users.update_one({"wa_id": wa_id}, {"$set": {
-                "name": data["name"],
-                "email": data["email"],
-                "phone": data["phone"],
-                "license_no": data["license_no"],
-                "available_dates": data.get("available_dates", []),
-                "available_times": data.get("available_times", []),
-                "medical_id": data["medical_id_img"],
-                "govt_id": data["govt_id_img"],
-                "role": "Doctor",
-                "status": "Active",
-                "registered_at": datetime.utcnow()
-            }}, upsert=True)
-            
-            return (f"🎊 *Registration Complete!*\n\n"
-                    f"Welcome to the team, Dr. {data['name']}! 🩺\n"
-                    f"Your professional credentials have been securely stored for verification.\n\n"
-                    "Your dashboard is now ready."), "DOCTOR_DASHBOARD", data, [{"id": "DR_VIEW_REQS", "title": "View Requests"}], None
-        return "❌ Please send an *image* of your Government ID.", "DR_REG_GOVT_ID", data, None, None
-
-    elif state == "ROLE_SELECTION":
-        if text == "ROLE_OTHER":
-            return "Thank you! Please tell us how we can help you specifically.", "OTHER_FLOW", {"role": "Other"}, None, None
-        return "Please select your role from the buttons above ⬆️", "ROLE_SELECTION", {}, None, None
-
-    elif state == "OTHER_FLOW":
-        return "Thank you for sharing. We will get back to you soon.", "START", {}, None, None
-
-    # --- Catch All ---
-    return "Hello! Type 'START' to welcome Mindly.", "START", {}, None, None
+            result = json.loads(response_text)
+            risk_level = str(result.get("risk_level", "")).strip().upper()
+            reply = result["reply"].strip()
+            if risk_level not in RISK_LEVELS:
+                risk_level = local_level
+            # A local crisis match always wins over the model's label
+            if confident and local_level == "CRITICAL":
+                risk_level = "CRITICAL"
+            if reply:
+                return risk_level, reply
+        except (LLMUnavailable, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Error in combined Mindly call, falling back: {e}")
+
+    if confident:
+        return local_level, generate_mindly_response(user_message, local_level, history)
+
+    # Draft the reply with the local guess while Gemini classifies
+    risk_future = _ai_pool.submit(classify_risk, user_message)
+    reply_future = _ai_pool.submit(generate_mindly_response, user_message, local_level, history)
+    risk_level = risk_future.result()
+    reply = reply_future.result()
+
+    # Never send a reply tuned for a lower risk than the one detected
+    if RISK_LEVELS.index(risk_level) > RISK_LEVELS.index(local_level) and risk_level in ("HIGH", "CRITICAL"):
+        reply = generate_mindly_response(user_message, risk_level, history)
+    return risk_level, reply
+
+def _send(payload, kind):
+    """
+    Sends a prebuilt payload through the pooled Graph API client.
+    """
+    try:
+        return get_graph_client().send_message(payload)
+    except Exception as e:
+        print(f"Error sending WhatsApp {kind}: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+             print(f"Response: {e.response.text}")
+        return None
 
-def send_whatsapp_list_message(recipient_id, text, list_data):
+def build_list_payload(recipient_id, text, list_data):
     """
-    Sends a native WhatsApp List Message (Selection Menu).
+    Builds a native WhatsApp List Message (Selection Menu).
     """
-    url = f"https://graph.facebook.com/v18.0/{Config.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
     formatted_sections = []
     for section in list_data["sections"]:
         formatted_rows = []
@@ -699,7 +287,7 @@ def send_whatsapp_list_message(recipient_id, text, list_data):
             "rows": formatted_rows
         })
         
-    payload = {
+    return {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
         "to": recipient_id,
@@ -714,28 +302,12 @@ def send_whatsapp_list_message(recipient_id, text, list_data):
             }
         }
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"Error sending WhatsApp list message: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-             print(f"Response: {e.response.text}")
-        return None
 
-def send_whatsapp_button_message(recipient_id, text, buttons):
+def build_button_payload(recipient_id, text, buttons):
     """
-    Sends a message with native WhatsApp buttons (Quick Replies).
+    Builds a message with native WhatsApp buttons (Quick Replies).
     Maximum 3 buttons allowed for Quick Replies.
     """
-    url = f"https://graph.facebook.com/v18.0/{Config.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
     formatted_buttons = []
     for btn in buttons[:3]: # Meta limit is 3 buttons for quick_reply
         formatted_buttons.append({
@@ -746,7 +318,7 @@ def send_whatsapp_button_message(recipient_id, text, buttons):
             }
         })
         
-    payload = {
+    return {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
         "to": recipient_id,
@@ -757,28 +329,12 @@ def send_whatsapp_button_message(recipient_id, text, buttons):
             "action": {"buttons": formatted_buttons}
         }
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"Error sending WhatsApp button message: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-             print(f"Response: {e.response.text}")
-        return None
 
-def send_whatsapp_flow_message(recipient_id, text, flow_data):
+def build_flow_payload(recipient_id, text, flow_data):
     """
-    Sends a native WhatsApp Flow message.
+    Builds a native WhatsApp Flow message.
     """
-    url = f"https://graph.facebook.com/v18.0/{Config.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
+    return {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
         "to": recipient_id,
@@ -802,41 +358,62 @@ def send_whatsapp_flow_message(recipient_id, text, flow_data):
             }
         }
     }
-    
-    try:
-        print(f"DEBUG: Sending Flow {flow_data['flow_id']} to {recipient_id}", flush=True)
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"DEBUG: Meta Response: {response.text}", flush=True)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"Error sending WhatsApp flow message: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-             print(f"Response: {e.response.text}")
-        return None
 
-def send_whatsapp_message(recipient_id, message_text):
+def build_text_payload(recipient_id, message_text):
     """
-    Sends a message via the WhatsApp Cloud API.
+    Builds a plain text message.
     """
-    url = f"https://graph.facebook.com/v18.0/{Config.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
+    return {
         "messaging_product": "whatsapp",
         "to": recipient_id,
         "type": "text",
         "text": {"body": message_text}
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"Error sending WhatsApp message: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-             print(f"Response: {e.response.text}")
-        return None
+
+def build_reply_payload(recipient_id, response_text, buttons=None, list_data=None):
+    """
+    Builds the payload for a state machine reply (List, Button, Flow or Text).
+    """
+    if list_data:
+        if isinstance(list_data, dict) and list_data.get("type") == "flow":
+            return build_flow_payload(recipient_id, response_text, list_data), "flow message"
+        return build_list_payload(recipient_id, response_text, list_data), "list message"
+    elif buttons:
+        return build_button_payload(recipient_id, response_text, buttons), "button message"
+    return build_text_payload(recipient_id, response_text), "message"
+
+def dispatch_payload(payload, kind="message"):
+    """
+    Hands a payload to the outbound dispatcher when async sending is on,
+    otherwise (or if the dispatcher is saturated) sends it inline.
+    """
+    if Config.WHATSAPP_ASYNC_SEND and outbound_dispatcher.enqueue(payload, kind):
+        return True
+    return _send(payload, kind)
+
+def send_whatsapp_list_message(recipient_id, text, list_data):
+    """
+    Sends a native WhatsApp List Message (Selection Menu).
+    """
+    return _send(build_list_payload(recipient_id, text, list_data), "list message")
+
+def send_whatsapp_button_message(recipient_id, text, buttons):
+    """
+    Sends a message with native WhatsApp buttons (Quick Replies).
+    """
+    return _send(build_button_payload(recipient_id, text, buttons), "button message")
+
+def send_whatsapp_flow_message(recipient_id, text, flow_data):
+    """
+    Sends a native WhatsApp Flow message.
+    """
+    print(f"DEBUG: Sending Flow {flow_data['flow_id']} to {recipient_id}", flush=True)
+    response = _send(build_flow_payload(recipient_id, text, flow_data), "flow message")
+    print(f"DEBUG: Meta Response: {response}", flush=True)
+    return response
+
+def send_whatsapp_message(recipient_id, message_text):
+    """
+    Sends a message via the WhatsApp Cloud API.
+    """
+    return _send(build_text_payload(recipient_id, message_text), "message")
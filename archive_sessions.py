@@ -0,0 +1,10 @@
+from app import create_app
+from app.services.session_service import archive_stale_sessions
+import sys
+
+limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+app = create_app()
+with app.app_context():
+    archived = archive_stale_sessions(limit)
+print(f"🗄️ Archived {archived} idle sessions.")
@@ -0,0 +1,10 @@
+from app import create_app
+from app.services.outbound_dispatcher import replay_dead_letters
+import sys
+
+limit = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+app = create_app()
+with app.app_context():
+    replayed, failed = replay_dead_letters(limit)
+print(f"📨 Replayed {replayed} dead-lettered messages, {failed} still failing.")
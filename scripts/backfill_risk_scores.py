@@ -0,0 +1,118 @@
+import sys
+import os
+import time
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+# Add parent directory to sys.path to allow imports from app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pymongo import UpdateOne
+from app import create_app
+from app.database import get_db
+from app.services.risk_classifier import fast_classify
+from app.services.llm_client import LLMUnavailable
+from app.services.whatsapp_service import classify_risk_with_gemini
+
+# Collection -> field holding the text to score
+TARGETS = {
+    "journal_entries": "content",
+}
+
+def score(text):
+    """
+    Local fast path first, Gemini only for ambiguous text.
+    Returns (risk_level, source). When Gemini fails the local guess is
+    returned with source "fallback", and later runs score it again.
+    """
+    level, confident = fast_classify(text)
+    if confident:
+        return level, "local"
+    try:
+        return classify_risk_with_gemini(text), "gemini"
+    except LLMUnavailable as e:
+        print(f"WARNING: Gemini scoring failed, keeping local guess {level}: {e}", flush=True)
+        return level, "fallback"
+
+def batches(cursor, size):
+    while True:
+        batch = list(islice(cursor, size))
+        if not batch:
+            return
+        yield batch
+
+def backfill(collection, batch_size=200, workers=8, rescore=False, limit=None):
+    """
+    Streams unscored documents in _id order, scores each batch on a bounded
+    worker pool, writes the results with one bulk_write and checkpoints the
+    last _id so an interrupted run resumes where it stopped. The checkpoint
+    only skips unscored documents; ones left with a "fallback" score are
+    selected again by every run until Gemini scores them.
+    """
+    db = get_db()
+    field = TARGETS[collection]
+    checkpoint_id = f"risk_backfill:{collection}"
+
+    query = {field: {"$exists": True}}
+    checkpoint = db.job_checkpoints.find_one({"_id": checkpoint_id})
+    if not rescore:
+        unscored = {"risk_level": {"$exists": False}}
+        if checkpoint:
+            unscored["_id"] = {"$gt": checkpoint["last_id"]}
+        query["$or"] = [unscored, {"risk_source": "fallback"}]
+    if checkpoint and not rescore:
+        print(f"Resuming {collection} after {checkpoint['last_id']} ({checkpoint.get('processed', 0)} already scored)")
+
+    processed = checkpoint.get("processed", 0) if checkpoint and not rescore else 0
+    counts = {"local": 0, "gemini": 0, "fallback": 0}
+    started = time.perf_counter()
+
+    cursor = db[collection].find(query, {field: 1}, no_cursor_timeout=True).sort("_id", 1).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    with cursor, ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batches(cursor, batch_size):
+            results = list(pool.map(lambda doc: score(doc.get(field) or ""), batch))
+            now = datetime.datetime.utcnow()
+
+            db[collection].bulk_write([
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"risk_level": level, "risk_source": source, "risk_scored_at": now}})
+                for doc, (level, source) in zip(batch, results)
+            ], ordered=False)
+
+            processed += len(batch)
+            for _, source in results:
+                counts[source] += 1
+            # $max: a batch of retried fallbacks must not move the checkpoint back
+            db.job_checkpoints.update_one({"_id": checkpoint_id}, {
+                "$set": {"processed": processed, "updated_at": now},
+                "$max": {"last_id": batch[-1]["_id"]}
+            }, upsert=True)
+
+            elapsed = time.perf_counter() - started
+            scored = sum(counts.values())
+            print(f"{collection}: {scored} scored this run ({scored / elapsed:.1f} docs/s) | "
+                  f"local {counts['local']}, gemini {counts['gemini']}, fallback {counts['fallback']}", flush=True)
+
+    elapsed = time.perf_counter() - started
+    scored = sum(counts.values())
+    print(f"Done {collection}: {scored} documents in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} docs/s)")
+    if counts["fallback"]:
+        print(f"{counts['fallback']} documents kept a fallback score; run again to retry them")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill risk levels for journal entries.")
+    parser.add_argument("collections", nargs="*", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent scoring workers (bounds Gemini concurrency)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--rescore", action="store_true", help="Ignore the checkpoint and rescore everything")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        for name in args.collections:
+            backfill(name, args.batch_size, args.workers, args.rescore, args.limit)
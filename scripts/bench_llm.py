@@ -0,0 +1,58 @@
+import sys
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to sys.path to allow imports from app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Benchmarks run offline against the stub backend unless told otherwise
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("AI_CACHE_ENABLED", "false")
+
+from app.services.llm_client import get_llm_client
+from app.services.whatsapp_service import classify_and_respond
+
+MESSAGES = [
+    "I'm a bit worried about my upcoming exams. I have so much to study.",
+    "I can't seem to focus on anything. I've been crying for days because of the pressure.",
+    "I can't do this anymore. Everything is falling apart and I feel empty.",
+    "My roommate and I keep fighting and I don't know how to talk to them.",
+    "I feel like I'm behind everyone else in my program.",
+]
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+def run(requests_count, workers):
+    """
+    Drives the emotional support path with `workers` concurrent callers
+    (standing in for gunicorn worker threads) and reports throughput.
+    """
+    def one(i):
+        start = time.perf_counter()
+        classify_and_respond(MESSAGES[i % len(MESSAGES)])
+        return (time.perf_counter() - start) * 1000
+
+    get_llm_client().stats.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - started
+
+    print(f"workers={workers} requests={requests_count} elapsed={elapsed:.2f}s throughput={requests_count / elapsed:.1f} req/s")
+    print(f"latency ms: p50={percentile(latencies, 0.5):.0f} p95={percentile(latencies, 0.95):.0f} p99={percentile(latencies, 0.99):.0f}")
+    for label, stats in get_llm_client().stats.snapshot().items():
+        print(f"  {label}: {stats}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the support reply path against the configured LLM backend.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    print(f"Backend: {os.environ['LLM_BACKEND']}")
+    for workers in args.workers:
+        run(args.requests, workers)
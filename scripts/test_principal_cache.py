@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Add parent directory to sys.path to allow imports from app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.database import get_db
+from app.services.conversation_flow import handle_conversational_flow
+from app.services.principal_cache import get_principal
+
+# Runs against the configured MongoDB with a throwaway user
+TEST_WA_ID = "test-principal-cache"
+
+def test_test_registration_forgets_principal():
+    """
+    TEST REGISTRATION deletes the user; a token for them must stop
+    resolving instead of being served from the principal cache.
+    """
+    db = get_db()
+    db.users.delete_many({"wa_id": TEST_WA_ID})
+    user_id = str(db.users.insert_one({"wa_id": TEST_WA_ID, "name": "Cache Test", "role": "Student"}).inserted_id)
+    try:
+        if get_principal(user_id) is None:
+            print("FAIL: principal not loaded for the new user")
+            return False
+
+        handle_conversational_flow(TEST_WA_ID, "TEST REGISTRATION", {"state": "START", "data": {}})
+
+        if get_principal(user_id) is not None:
+            print("FAIL: deleted user still served from the principal cache")
+            return False
+        print("OK: principal cache missed after TEST REGISTRATION")
+        return True
+    finally:
+        db.users.delete_many({"wa_id": TEST_WA_ID})
+        db.chat_sessions.delete_many({"wa_id": TEST_WA_ID})
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        if not test_test_registration_forgets_principal():
+            sys.exit(1)
@@ -5,9 +5,36 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 print("Debug: Importing whatsapp_service...")
-from app.services.whatsapp_service import classify_risk, generate_mindly_response
+from app.services.whatsapp_service import classify_risk, generate_mindly_response, classify_and_respond
+from app.services.risk_classifier import fast_classify
 print("Debug: Imports successful.")
 
+# Indirect suicidal hints wrapped in exam stress; the local fast path must
+# never settle these as a confident LOW
+INDIRECT_HINTS = [
+    "I failed my exam and I dont want to be here anymore",
+    "my grades are bad, nobody would care if I was gone",
+    "I have an exam tomorrow and I just want it all to stop",
+    "feel a little like ending it after this test",
+    "tired of everything, i want to sleep forever after this exam"
+]
+
+def test_fast_classify():
+    print("--- Checking local pre-classification ---")
+    failures = 0
+    for message in INDIRECT_HINTS:
+        level, confident = fast_classify(message)
+        if level == "LOW" and confident:
+            failures += 1
+            print(f"FAIL: confident LOW for indirect hint: {message}")
+        else:
+            print(f"OK ({level}, confident={confident}): {message}")
+    level, confident = fast_classify("I'm a bit worried about my upcoming exams. I have so much to study.")
+    if (level, confident) != ("LOW", True):
+        failures += 1
+        print(f"FAIL: plain exam stress classified as ({level}, {confident})")
+    return failures == 0
+
 def test_logic():
     test_cases = [
         {
@@ -45,7 +72,14 @@ def test_logic():
         if risk_level == "CRITICAL" and "help" not in ai_response.lower() and "support" not in ai_response.lower():
             print("WARNING: Critical risk might not have enough urgency in response.")
 
+        # 3. Test Combined Mode (single call)
+        combined_risk, combined_response = classify_and_respond(case['message'])
+        print(f"Combined Risk Level: {combined_risk}")
+        print(f"Combined Response: {combined_response[:150]}...")
+
     print("\n--- Verification Complete ---")
 
 if __name__ == "__main__":
+    if not test_fast_classify():
+        sys.exit(1)
     test_logic()
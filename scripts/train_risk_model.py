@@ -0,0 +1,65 @@
+import sys
+import os
+import json
+import math
+from collections import Counter
+
+# Add parent directory to sys.path to allow imports from app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.risk_classifier import TOKEN_PATTERN
+
+LABELS = ["LOW", "MODERATE", "HIGH", "CRITICAL"]
+
+def load_examples(path):
+    """
+    Reads labelled examples from a JSONL file of {"text": ..., "label": ...}.
+    """
+    examples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            label = row["label"].strip().upper()
+            if label in LABELS:
+                examples.append((row["text"], label))
+    return examples
+
+def train(examples, min_count=2):
+    """
+    Multinomial naive Bayes with Laplace smoothing, stored as log probabilities.
+    """
+    doc_counts = Counter(label for _, label in examples)
+    token_counts = {label: Counter() for label in LABELS}
+    for text, label in examples:
+        token_counts[label].update(TOKEN_PATTERN.findall(text.lower()))
+
+    totals = Counter()
+    for counts in token_counts.values():
+        totals.update(counts)
+    vocab = {token for token, count in totals.items() if count >= min_count}
+
+    priors, likelihoods, unknown = {}, {}, {}
+    for label in LABELS:
+        if not doc_counts[label]:
+            continue
+        total = sum(token_counts[label][token] for token in vocab)
+        denominator = total + len(vocab) + 1
+        priors[label] = math.log(doc_counts[label] / len(examples))
+        likelihoods[label] = {token: math.log((token_counts[label][token] + 1) / denominator) for token in vocab}
+        unknown[label] = math.log(1 / denominator)
+
+    return {"priors": priors, "likelihoods": likelihoods, "unknown": unknown}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python scripts/train_risk_model.py <examples.jsonl> <model.json>")
+        sys.exit(1)
+
+    examples = load_examples(sys.argv[1])
+    params = train(examples)
+    with open(sys.argv[2], "w") as f:
+        json.dump(params, f)
+    print(f"Trained on {len(examples)} examples ({', '.join(params['priors'])}), saved to {sys.argv[2]}")